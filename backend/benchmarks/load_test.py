@@ -0,0 +1,369 @@
+"""
+Load Test Driver
+Measures throughput and p50/p95/p99 latency per endpoint at fixed concurrency levels
+
+Spawn the API against the local Visual Crossing stand-in and compare with the stored baseline:
+    python benchmarks/load_test.py --spawn --baseline benchmarks/baseline.json
+
+Exits with status 1 when any scenario regresses beyond --tolerance, so it can gate CI, and
+with status 2 when the run settings differ from the baseline's.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import aiohttp
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PLACES = ['new york', 'london', 'paris', 'tokyo', 'sydney', 'dubai', 'mumbai', 'los angeles', 'chicago', 'madrid']
+
+# Each scenario performs one timed operation with a seeded Random and reports whether it succeeded
+Scenario = Callable[[aiohttp.ClientSession, random.Random], Awaitable[bool]]
+
+
+def _location_pool(size: int = 200, seed: int = 7) -> List[Tuple[float, float]]:
+    """Fixed set of coordinates so runs see the same mix of cache hits and misses"""
+    rng = random.Random(seed)
+    return [(round(rng.uniform(-60, 70), 3), round(rng.uniform(-180, 180), 3)) for _ in range(size)]
+
+
+LOCATIONS = _location_pool()
+
+
+def _fresh_location(rng: random.Random) -> Dict[str, Any]:
+    """Coordinates outside the pool, drawn fine enough that practically every request misses the cache"""
+    return {'lat': round(rng.uniform(-60, 70), 4), 'lon': round(rng.uniform(-180, 180), 4),
+            'location_name': 'Benchmark'}
+
+
+async def _request(session: aiohttp.ClientSession, method: str, path: str, **kwargs) -> bool:
+    async with session.request(method, path, **kwargs) as response:
+        await response.read()
+        return response.status in (200, 202)
+
+
+def _gpm_job(rng: random.Random) -> Dict[str, Any]:
+    """One of a small pool of analyses, so most submissions exercise deduplication"""
+    first = rng.randint(1, 12)
+    last = rng.randint(first, 12)
+    return {'kind': 'gpm_precipitation',
+            'params': {'start_date': f"2024-{first:02d}-01", 'end_date': f"2024-{last:02d}-28"}}
+
+
+async def _nasa_job_result(session: aiohttp.ClientSession, rng: random.Random) -> bool:
+    """Submit a fresh one to four week GPM analysis and poll until its result is ready"""
+    start = date(2024, 1, 1) + timedelta(days=rng.randint(0, 330))
+    end = start + timedelta(days=rng.randint(6, 27))
+    lat_min = round(rng.uniform(0, 40), 6)  # makes every job unique, so none are deduplicated
+    job = {'kind': 'gpm_precipitation', 'params': {
+        'start_date': start.isoformat(), 'end_date': end.isoformat(),
+        'lat_range': [lat_min, lat_min + 20], 'lon_range': [-130, -60]}}
+    async with session.post('/nasa/jobs', json=job) as response:
+        if response.status != 202:
+            return False
+        job_id = (await response.json())['job_id']
+    while True:
+        async with session.get(f"/nasa/jobs/{job_id}/result") as response:
+            await response.read()
+            if response.status != 202:
+                return response.status == 200
+        await asyncio.sleep(0.05)
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    # Pooled locations, primed before each level: the cache-hit path
+    'weather': lambda session, rng: _request(session, 'GET', '/weather', params=dict(
+        zip(('lat', 'lon'), rng.choice(LOCATIONS)), location_name='Benchmark')),
+    # Upstream round trip, formatting and cache write on every request, so stub settings show up here
+    'weather_cold': lambda session, rng: _request(session, 'GET', '/weather', params=_fresh_location(rng)),
+    'geocode': lambda session, rng: _request(session, 'GET', '/geocode', params={'q': rng.choice(PLACES)}),
+    # Submission only; mostly deduplicated 202s, so this measures the job API's front door
+    'nasa_jobs': lambda session, rng: _request(session, 'POST', '/nasa/jobs', json=_gpm_job(rng)),
+    # Submit-to-result latency of the NASA analysis path, including queueing behind other jobs
+    'nasa_job_result': _nasa_job_result,
+}
+
+# Requests issued before each level of a scenario so every level starts from the same warm cache
+PRIMERS: Dict[str, Callable[[], List[Tuple[str, str, Dict[str, Any]]]]] = {
+    'weather': lambda: [('GET', '/weather', {'params': {'lat': lat, 'lon': lon, 'location_name': 'Benchmark'}})
+                        for lat, lon in LOCATIONS],
+    'geocode': lambda: [('GET', '/geocode', {'params': {'q': place}}) for place in PLACES],
+}
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+async def prime(session: aiohttp.ClientSession, name: str, concurrency: int = 16):
+    """Issue the scenario's priming requests, if it has any"""
+    requests = PRIMERS.get(name, lambda: [])()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def issue(method: str, path: str, kwargs: Dict[str, Any]):
+        async with semaphore:
+            try:
+                await _request(session, method, path, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+    await asyncio.gather(*(issue(*request) for request in requests))
+
+
+async def run_level(base_url: str, name: str, concurrency: int, duration: float,
+                    warmup: float, seed: int) -> Dict[str, Any]:
+    """Keep `concurrency` operations in flight for `duration` seconds and summarise latencies"""
+    scenario = SCENARIOS[name]
+    latencies: List[float] = []
+    errors = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=30)
+
+    async with aiohttp.ClientSession(base_url, connector=connector, timeout=timeout) as session:
+        await prime(session, name)
+        measure_from = time.perf_counter() + warmup
+        stop_at = measure_from + duration
+
+        async def worker(worker_id: int):
+            nonlocal errors
+            # Distinct streams per level too, so later levels do not replay jobs finished by earlier ones
+            rng = random.Random((seed * 1000 + concurrency) * 1000 + worker_id)
+            while True:
+                started = time.perf_counter()
+                if started >= stop_at:
+                    return
+                try:
+                    ok = await scenario(session, rng)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    ok = False
+                if started < measure_from:
+                    continue
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+    latencies.sort()
+    total = len(latencies) + errors
+    return {
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'throughput_rps': round(len(latencies) / duration, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2)
+    }
+
+
+async def run_suite(base_url: str, scenarios: List[str], levels: List[int], duration: float,
+                    warmup: float, seed: int) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in scenarios:
+        results[name] = {}
+        for concurrency in levels:
+            summary = await run_level(base_url, name, concurrency, duration, warmup, seed)
+            results[name][str(concurrency)] = summary
+            print(f"{name:<16} c={concurrency:<4} {summary['throughput_rps']:>9.1f} req/s  "
+                  f"p50 {summary['p50_ms']:>8.2f}ms  p95 {summary['p95_ms']:>8.2f}ms  "
+                  f"p99 {summary['p99_ms']:>8.2f}ms  errors {summary['errors']}")
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Describe every metric that is worse than the baseline by more than `tolerance`"""
+    regressions = []
+    for name, levels in baseline.get('results', {}).items():
+        for concurrency, base in levels.items():
+            current = results.get(name, {}).get(concurrency)
+            if current is None:
+                continue
+            label = f"{name} c={concurrency}"
+            for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+                if base[key] and current[key] > base[key] * (1 + tolerance):
+                    regressions.append(f"{label}: {key} {current[key]} > {base[key]} (+{tolerance:.0%})")
+            if current['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+                regressions.append(f"{label}: throughput {current['throughput_rps']} < {base['throughput_rps']} (-{tolerance:.0%})")
+            if current['error_rate'] > base['error_rate'] + 0.01:
+                regressions.append(f"{label}: error rate {current['error_rate']} > {base['error_rate']}")
+    return regressions
+
+
+# Settings that change what a run measures; results taken with different values are not comparable
+COMPARABLE_ENVIRONMENT = ('workers',)
+INFORMATIONAL_ENVIRONMENT = ('python', 'machine', 'cpus')
+
+
+def check_comparable(report: Dict[str, Any], baseline: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """(mismatches that invalidate the comparison, differences worth a warning)"""
+    mismatches, warnings = [], []
+    settings, base_settings = report['settings'], baseline.get('settings', {})
+    for key in sorted(set(settings) | set(base_settings)):
+        if settings.get(key) != base_settings.get(key):
+            mismatches.append(f"setting {key}: {settings.get(key)} (baseline {base_settings.get(key)})")
+    environment, base_environment = report['environment'], baseline.get('environment', {})
+    for keys, bucket in ((COMPARABLE_ENVIRONMENT, mismatches), (INFORMATIONAL_ENVIRONMENT, warnings)):
+        for key in keys:
+            if environment.get(key) != base_environment.get(key):
+                bucket.append(f"environment {key}: {environment.get(key)} (baseline {base_environment.get(key)})")
+    return mismatches, warnings
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_ready(url: str, deadline: float = 30):
+    stop = time.monotonic() + deadline
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < stop:
+            try:
+                async with session.get(url) as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+def spawn_stack(args) -> Tuple[str, List[subprocess.Popen]]:
+    """Start the Visual Crossing stub and the API (with the given worker count) on free ports"""
+    stub_port, api_port = _free_port(), _free_port()
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(BACKEND_DIR, 'benchmarks', 'visual_crossing_stub.py'),
+        '--port', str(stub_port), '--latency-ms', str(args.stub_latency_ms),
+        '--jitter-ms', str(args.stub_jitter_ms), '--error-rate', str(args.stub_error_rate),
+        '--days', str(args.stub_days), '--seed', str(args.seed)
+    ])
+    env = {
+        **os.environ,
+        'VISUAL_CROSSING_API_KEY': 'benchmark',
+        'VISUAL_CROSSING_BASE_URL': f"http://127.0.0.1:{stub_port}",
+        # The benchmark measures the service, not the query budget
+        'QUOTA_PER_MINUTE': '1000000000',
+        'QUOTA_PER_DAY': '1000000000000',
+        'QUOTA_STATE_PATH': os.path.join(tempfile.mkdtemp(prefix='foretrip-bench-quota-'), 'quota.db'),
+        # Start every run without cached responses or job checkpoints from earlier runs
+        'CACHE_URL': f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='foretrip-bench-cache-'), 'cache.db')}",
+        'JOB_CHECKPOINT_DIR': tempfile.mkdtemp(prefix='foretrip-bench-jobs-'),
+    }
+    api = subprocess.Popen([
+        sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(api_port),
+        '--workers', str(args.workers), '--log-level', 'warning'
+    ], cwd=BACKEND_DIR, env=env)
+    return f"http://127.0.0.1:{api_port}", [api, stub]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', help='Benchmark an already running API instead of spawning one')
+    parser.add_argument('--spawn', action='store_true', help='Start the stub and the API locally')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers when spawning')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=10, help='Measured seconds per level')
+    parser.add_argument('--warmup', type=float, default=2, help='Unmeasured seconds before each level')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--stub-latency-ms', type=float, default=50)
+    parser.add_argument('--stub-jitter-ms', type=float, default=10)
+    parser.add_argument('--stub-error-rate', type=float, default=0.0)
+    parser.add_argument('--stub-days', type=int, default=15)
+    parser.add_argument('--output', help='Write results as JSON')
+    parser.add_argument('--baseline', help='Baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative regression')
+    parser.add_argument('--update-baseline', action='store_true', help='Overwrite --baseline with these results')
+    parser.add_argument('--allow-mismatch', action='store_true',
+                        help='Compare even when run settings differ from the baseline')
+    args = parser.parse_args()
+
+    if not args.base_url and not args.spawn:
+        parser.error('pass --base-url or --spawn')
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    run_info = {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'workers': args.workers if args.spawn else None,
+        },
+        'settings': {
+            'duration': args.duration, 'warmup': args.warmup, 'seed': args.seed,
+            'stub_latency_ms': args.stub_latency_ms, 'stub_jitter_ms': args.stub_jitter_ms,
+            'stub_error_rate': args.stub_error_rate, 'stub_days': args.stub_days
+        }
+    }
+    baseline = None
+    if args.baseline and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # Checked before running so a mismatched invocation fails in seconds, not minutes
+        mismatches, warnings = check_comparable(run_info, baseline)
+        for line in warnings:
+            print(f"Warning: {line}")
+        if mismatches:
+            print('Run settings differ from the baseline:')
+            for line in mismatches:
+                print(f"  {line}")
+            if not args.allow_mismatch:
+                print('Not comparing; rerun with matching settings, refresh the baseline, or pass --allow-mismatch')
+                sys.exit(2)
+
+    processes: List[subprocess.Popen] = []
+    base_url = args.base_url
+    try:
+        if args.spawn:
+            base_url, processes = spawn_stack(args)
+        asyncio.run(_wait_ready(f"{base_url}/health"))
+        results = asyncio.run(run_suite(base_url, scenarios, levels, args.duration, args.warmup, args.seed))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), **run_info, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('\nRegressions against baseline:')
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print('\nNo regressions against baseline')
+
+
+if __name__ == '__main__':
+    main()
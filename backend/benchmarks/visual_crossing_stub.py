@@ -0,0 +1,133 @@
+"""
+Visual Crossing Stand-in
+Local emulation of the timeline and geocoding APIs with configurable latency, errors and payload size
+
+Run with:
+    python benchmarks/visual_crossing_stub.py --port 8090 --latency-ms 80 --error-rate 0.01
+and point the API at it with VISUAL_CROSSING_BASE_URL=http://127.0.0.1:8090
+"""
+
+import argparse
+import asyncio
+import hashlib
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Tuple
+
+from aiohttp import web
+
+
+def _seeded(*parts: Any) -> random.Random:
+    """Deterministic generator so identical requests get identical payloads"""
+    digest = hashlib.blake2b('|'.join(str(p) for p in parts).encode(), digest_size=8).digest()
+    return random.Random(int.from_bytes(digest, 'big'))
+
+
+def _resolve(location: str) -> Tuple[float, float, str]:
+    """`lat,lon` strings pass through; place names get a stable fake coordinate"""
+    try:
+        lat, lon = (float(part) for part in location.split(','))
+        return lat, lon, f"{lat},{lon}"
+    except ValueError:
+        rng = _seeded('geocode', location.lower())
+        return round(rng.uniform(-60, 70), 4), round(rng.uniform(-180, 180), 4), f"{location.title()}, Stubland"
+
+
+def _conditions(rng: random.Random, lat: float) -> Dict[str, Any]:
+    temp = round(20 - abs(lat) / 3 + rng.uniform(-5, 5), 1)
+    precip = round(rng.uniform(0, 5), 1)
+    cloudcover = rng.randint(0, 100)
+    return {
+        'temp': temp,
+        'feelslike': round(temp + rng.uniform(-2, 2), 1),
+        'humidity': rng.randint(30, 90),
+        'precip': precip,
+        'windspeed': round(rng.uniform(5, 25), 1),
+        'winddir': rng.randint(0, 359),
+        'cloudcover': cloudcover,
+        'uvindex': rng.randint(0, 11),
+        'visibility': round(rng.uniform(10, 30), 1),
+        'pressure': round(rng.uniform(990, 1030), 1),
+        'conditions': 'Rain' if precip > 2 else 'Overcast' if cloudcover > 80 else 'Partially cloudy' if cloudcover > 50 else 'Clear',
+        'description': 'Synthetic conditions from the benchmark stub'
+    }
+
+
+def build_timeline(location: str, start: str, days: int, hours: bool) -> Dict[str, Any]:
+    lat, lon, resolved = _resolve(location)
+    first = datetime.strptime(start, '%Y-%m-%d') if start else datetime(2024, 1, 1)
+    rng = _seeded(lat, lon, first.date())
+
+    day_list = []
+    for i in range(days):
+        date = first + timedelta(days=i)
+        day = {'datetime': date.strftime('%Y-%m-%d'), **_conditions(rng, lat)}
+        day['tempmax'] = round(day['temp'] + rng.uniform(2, 6), 1)
+        day['tempmin'] = round(day['temp'] - rng.uniform(2, 6), 1)
+        if hours:
+            day['hours'] = [{'datetime': f"{h:02d}:00:00", **_conditions(rng, lat)} for h in range(24)]
+        day_list.append(day)
+
+    return {
+        'queryCost': days,
+        'latitude': lat,
+        'longitude': lon,
+        'resolvedAddress': resolved,
+        'address': location,
+        'timezone': 'UTC',
+        'tzoffset': 0.0,
+        'currentConditions': {'datetime': '12:00:00', 'datetimeEpoch': int(first.timestamp()), **_conditions(rng, lat)},
+        'days': day_list
+    }
+
+
+def create_app(latency_ms: float = 50, jitter_ms: float = 20, error_rate: float = 0.0,
+               days: int = 15, seed: int = 0) -> web.Application:
+    """Build the stub application; all knobs are also exposed as CLI flags"""
+    faults = random.Random(seed)
+
+    async def delay():
+        if latency_ms or jitter_ms:
+            await asyncio.sleep(max(0.0, faults.gauss(latency_ms, jitter_ms)) / 1000)
+
+    async def timeline(request: web.Request) -> web.Response:
+        await delay()
+        if faults.random() < error_rate:
+            status = faults.choice([429, 500, 503])
+            return web.json_response({'error': 'stub injected failure'}, status=status)
+
+        location = request.match_info['location']
+        include = request.query.get('include', '')
+        if 'days' not in include:
+            # Geocoding lookups only ask for the resolved location
+            lat, lon, resolved = _resolve(location)
+            return web.json_response({
+                'queryCost': 1, 'latitude': lat, 'longitude': lon, 'address': location, 'resolvedAddress': resolved
+            })
+
+        start = request.match_info.get('date', '').split('/')[0]
+        return web.json_response(build_timeline(location, start, days, 'hours' in include))
+
+    app = web.Application()
+    app.router.add_get('/timeline/{location}', timeline)
+    app.router.add_get('/timeline/{location}/{date:.+}', timeline)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=50, help='Mean added latency per request')
+    parser.add_argument('--jitter-ms', type=float, default=20, help='Standard deviation of added latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 429/5xx')
+    parser.add_argument('--days', type=int, default=15, help='Days per timeline response (controls payload size)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for latency and fault injection')
+    args = parser.parse_args()
+
+    app = create_app(args.latency_ms, args.jitter_ms, args.error_rate, args.days, args.seed)
+    web.run_app(app, host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
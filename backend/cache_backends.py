@@ -0,0 +1,219 @@
+"""
+Cache Backends
+Pluggable key/value caches so every uvicorn worker on a host can share one cache
+"""
+
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(ABC):
+    """Async key/value cache holding JSON-serializable values"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        value = await self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    @abstractmethod
+    async def _get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Store a value, expiring after `ttl` seconds if given"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Remove a key if present"""
+
+    async def close(self):
+        """Release any connections"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'backend': type(self).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Per-process LRU cache; each worker keeps its own copy"""
+
+    def __init__(self, max_entries: int = 5000):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def _get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._entries[key] = (value, time.time() + ttl if ttl is not None else None)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._entries.pop(key, None)
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Host-wide cache in a SQLite file (WAL mode) shared by all workers"""
+
+    # Expired rows are swept after this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str, max_entries: int = 50000):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL, updated REAL NOT NULL)'
+        )
+
+    def _get_sync(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires is not None and expires < time.time():
+            return None
+        return json.loads(value)
+
+    def _set_sync(self, key: str, value: str, ttl: Optional[float]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (key, value, expires, updated) VALUES (?, ?, ?, ?)',
+                (key, value, now + ttl if ttl is not None else None, now)
+            )
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._purge(now)
+
+    def _purge(self, now: float):
+        self._conn.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?', (now,))
+        self._conn.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY updated DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+
+    def _delete_sync(self, key: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    async def _get(self, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self._get_sync, key)
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await asyncio.to_thread(self._set_sync, key, json.dumps(value), ttl)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete_sync, key)
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisCacheBackend(CacheBackend):
+    """Adapter for a Redis-compatible server
+
+    `client` only needs async get(key), set(key, value, px=milliseconds) and delete(key),
+    so a local stand-in can replace the server in tests.
+    """
+
+    def __init__(self, client: Any, prefix: str = 'foretrip:'):
+        super().__init__()
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str) -> 'RedisCacheBackend':
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("Redis cache backend requires the 'redis' package (pip install redis)")
+        return cls(redis.from_url(url))
+
+    async def _get(self, key: str) -> Optional[Any]:
+        value = await self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        if ttl is not None and ttl <= 0:
+            # Redis rejects non-positive expiries; an already-expired entry is simply absent
+            await self.client.delete(self.prefix + key)
+            return
+        await self.client.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000) if ttl is not None else None)
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+    async def close(self):
+        close = getattr(self.client, 'aclose', None) or getattr(self.client, 'close', None)
+        if close is not None:
+            result = close()
+            if asyncio.iscoroutine(result):
+                await result
+
+
+def create_cache_backend(url: str = None) -> CacheBackend:
+    """Build a backend from a URL: memory://, sqlite:///path/to/cache.db or redis://host:port/db
+
+    Defaults to a SQLite file every worker on the host shares; memory:// keeps a
+    separate copy per process, which divides the hit rate by the worker count.
+    """
+    url = url or os.getenv('CACHE_URL', 'sqlite:///data/cache.db')
+    scheme = urlparse(url).scheme
+
+    if scheme == 'memory':
+        return MemoryCacheBackend(int(os.getenv('CACHE_MAX_ENTRIES', '5000')))
+    if scheme == 'sqlite':
+        # sqlite:///relative.db -> relative.db, sqlite:////abs/path.db -> /abs/path.db
+        path = url[len('sqlite:///'):] if url.startswith('sqlite:///') else url[len('sqlite://'):]
+        return SQLiteCacheBackend(path, int(os.getenv('CACHE_MAX_ENTRIES', '50000')))
+    if scheme in ('redis', 'rediss', 'unix'):
+        return RedisCacheBackend.from_url(url)
+    raise ValueError(f"Unsupported CACHE_URL scheme: {scheme}")
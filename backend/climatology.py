@@ -0,0 +1,481 @@
+"""
+Climatology Tables
+Per-cell day-of-year and monthly climatologies of NASA variables, kept on disk and updated day by day
+
+Each variable lives in its own directory of memory-mapped .npy arrays holding
+the observation count, mean and sum of squared deviations (Welford's M2) per
+calendar slot and grid cell. Ingesting a day updates one day-of-year slot and
+one month slot in place, so the tables never need recomputing, and a ledger of
+ingested dates keeps re-runs from counting a day twice. Each ingest first writes
+a journal of the slots it is about to change; an ingest that dies before its
+dates reach the ledger is rolled back from it, so a resumed chunk is counted
+once. Anomaly queries read a handful of array elements instead of scanning the
+archive.
+"""
+
+import os
+import json
+import fcntl
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import date as Date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Slot layout of the day-of-year tables; Feb 29 gets its own slot and later days line up across years
+_LEAP_YEAR = 2000
+
+# What each variable is computed from
+VARIABLES: Dict[str, Dict[str, str]] = {
+    'precipitation': {'source': 'gpm', 'field': 'precipitation', 'units': 'mm/hr'},
+    'land_surface_temperature': {'source': 'modis', 'product': 'MOD11A1', 'field': 'LST_Day', 'units': 'Kelvin'},
+}
+
+
+class ClimatologyError(Exception):
+    """Raised for unknown variables, locations outside the grid and days without data"""
+
+
+def _parse_date(value: str, field: str) -> Date:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ClimatologyError(f"{field} must be a YYYY-MM-DD date")
+
+
+def day_slot(day: Date) -> int:
+    """Index of a date in the 366-slot day-of-year tables"""
+    return day.replace(year=_LEAP_YEAR).timetuple().tm_yday - 1
+
+
+def _region_from_env() -> Dict[str, float]:
+    parts = [float(v) for v in os.getenv('CLIMATOLOGY_REGION', '20,50,-130,-60').split(',')]
+    return dict(zip(('lat_min', 'lat_max', 'lon_min', 'lon_max'), parts))
+
+
+class MomentTable:
+    """count / mean / M2 arrays shaped (slots, lat cells, lon cells)"""
+
+    def __init__(self, directory: str, name: str, shape: Tuple[int, int, int], create: bool):
+        mode = 'w+' if create else 'r+'
+
+        def open_array(suffix: str, dtype):
+            path = os.path.join(directory, f"{name}_{suffix}.npy")
+            return np.lib.format.open_memmap(path, mode=mode, dtype=dtype, shape=shape if create else None)
+
+        self.count = open_array('count', np.uint32)
+        self.mean = open_array('mean', np.float32)
+        self.m2 = open_array('m2', np.float32)
+
+    def add(self, slot: int, values: np.ndarray):
+        """Fold one grid of observations into a slot; NaN cells are skipped"""
+        ok = np.isfinite(values)
+        count, mean, m2 = self.count[slot], self.mean[slot], self.m2[slot]
+        count[ok] += 1
+        delta = values[ok] - mean[ok]
+        mean[ok] += delta / count[ok]
+        m2[ok] += delta * (values[ok] - mean[ok])
+
+    def pooled(self, slots: List[int], row: int, col: int, exclude: np.ndarray = None) -> Dict[str, Any]:
+        """Mean, standard deviation and count for one cell over several slots
+
+        `exclude` holds observations already folded into these slots (the
+        period being judged) to take back out, so it is not compared with itself.
+        """
+        counts = self.count[slots, row, col].astype(np.float64)
+        n = counts.sum()
+        means = self.mean[slots, row, col].astype(np.float64)
+        mean = float((counts * means).sum() / n) if n else 0.0
+        m2 = float(self.m2[slots, row, col].astype(np.float64).sum() + (counts * (means - mean) ** 2).sum())
+
+        if exclude is not None and len(exclude) and n:
+            # Reverse of the parallel-variance merge of (rest) and (excluded)
+            k = float(len(exclude))
+            excluded_mean = float(exclude.mean())
+            rest = n - k
+            if rest > 0:
+                rest_mean = (n * mean - k * excluded_mean) / rest
+                m2 = max(0.0, m2 - float(((exclude - excluded_mean) ** 2).sum())
+                         - (excluded_mean - rest_mean) ** 2 * rest * k / n)
+                mean = rest_mean
+            n = max(rest, 0.0)
+
+        if n <= 0:
+            return {'mean': None, 'std': None, 'count': 0}
+        return {'mean': mean, 'std': (m2 / (n - 1)) ** 0.5 if n > 1 else None, 'count': int(n)}
+
+    def snapshot(self, slots: List[int]) -> Dict[str, np.ndarray]:
+        return {'count': self.count[slots], 'mean': self.mean[slots], 'm2': self.m2[slots]}
+
+    def restore(self, slots: List[int], images: Dict[str, np.ndarray]):
+        self.count[slots] = images['count']
+        self.mean[slots] = images['mean']
+        self.m2[slots] = images['m2']
+
+    def flush(self):
+        for array in (self.count, self.mean, self.m2):
+            array.flush()
+
+
+class ClimatologyStore:
+    """On-disk climatology of one variable over a fixed regular grid"""
+
+    def __init__(self, directory: str, region: Dict[str, float], resolution: float, recent_days: int):
+        self.directory = directory
+        self.region = region
+        self.resolution = resolution
+        self.recent_days = recent_days
+        self.lat_cells = int(np.ceil((region['lat_max'] - region['lat_min']) / resolution))
+        self.lon_cells = int(np.ceil((region['lon_max'] - region['lon_min']) / resolution))
+        self._thread_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        with self._locked():
+            meta = self._read_meta()
+            create = meta is None
+            if create:
+                meta = {'grid': self._grid(), 'ingested': []}
+            elif meta['grid'] != self._grid():
+                raise ClimatologyError(
+                    f"{directory} was built for grid {meta['grid']}; restore those settings or remove the directory")
+
+            grid_shape = (self.lat_cells, self.lon_cells)
+            self.day_of_year = MomentTable(directory, 'doy', (366,) + grid_shape, create)
+            self.monthly = MomentTable(directory, 'month', (12,) + grid_shape, create)
+            # Ring buffer of the latest daily grids, keyed by date ordinal, to compare against the tables
+            path = os.path.join(directory, 'recent')
+            if create:
+                self.recent = np.lib.format.open_memmap(f"{path}.npy", mode='w+', dtype=np.float32,
+                                                        shape=(recent_days,) + grid_shape)
+                self.recent[:] = np.nan
+                self.recent_dates = np.lib.format.open_memmap(f"{path}_dates.npy", mode='w+', dtype=np.int64,
+                                                              shape=(recent_days,))
+                self._write_meta(meta)
+            else:
+                self.recent = np.lib.format.open_memmap(f"{path}.npy", mode='r+')
+                self.recent_dates = np.lib.format.open_memmap(f"{path}_dates.npy", mode='r+')
+                self._recover(meta)
+            self._ingested = set(meta['ingested'])
+
+    def _grid(self) -> Dict[str, Any]:
+        return {**self.region, 'resolution': self.resolution, 'recent_days': self.recent_days}
+
+    # -- persistence -------------------------------------------------------
+
+    @contextmanager
+    def _locked(self):
+        """Serialise writers across threads and across worker processes on the host"""
+        with self._thread_lock, open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.directory, 'meta.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta: Dict[str, Any]):
+        path = os.path.join(self.directory, 'meta.json')
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(meta, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _flush(self):
+        self.day_of_year.flush()
+        self.monthly.flush()
+        self.recent.flush()
+        self.recent_dates.flush()
+
+    # -- journal -----------------------------------------------------------
+
+    @property
+    def _journal_path(self) -> str:
+        return os.path.join(self.directory, 'journal.npz')
+
+    def _write_journal(self, days: List[Date]):
+        """Save the slots an ingest of `days` will change, as they are now, before changing them"""
+        doy_slots = sorted({day_slot(day) for day in days})
+        month_slots = sorted({day.month - 1 for day in days})
+        recent_slots = sorted({day.toordinal() % self.recent_days for day in days})
+        images = {'dates': np.array([day.toordinal() for day in days], dtype=np.int64),
+                  'doy_slots': np.array(doy_slots), 'month_slots': np.array(month_slots),
+                  'recent_slots': np.array(recent_slots),
+                  'recent': self.recent[recent_slots], 'recent_dates': self.recent_dates[recent_slots]}
+        for prefix, table, slots in (('doy', self.day_of_year, doy_slots), ('month', self.monthly, month_slots)):
+            images.update({f"{prefix}_{name}": image for name, image in table.snapshot(slots).items()})
+
+        path = self._journal_path
+        with open(f"{path}.tmp", 'wb') as f:
+            np.savez(f, **images)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+
+    def _recover(self, meta: Dict[str, Any]):
+        """Settle an ingest that died mid-way
+
+        meta.json is the commit point: if the journalled dates reached it the
+        ingest finished and the journal is stale, otherwise the tables are put
+        back as the journal found them.
+        """
+        if not os.path.exists(self._journal_path):
+            return
+        with np.load(self._journal_path) as journal:
+            dates = {Date.fromordinal(int(ordinal)).isoformat() for ordinal in journal['dates']}
+            if not dates <= set(meta['ingested']):
+                for prefix, table in (('doy', self.day_of_year), ('month', self.monthly)):
+                    table.restore(journal[f"{prefix}_slots"].tolist(),
+                                  {name: journal[f"{prefix}_{name}"] for name in ('count', 'mean', 'm2')})
+                recent_slots = journal['recent_slots'].tolist()
+                self.recent[recent_slots] = journal['recent']
+                self.recent_dates[recent_slots] = journal['recent_dates']
+                self._flush()
+                logger.warning(f"Rolled back an interrupted ingest of {len(dates)} days in {self.directory}")
+        os.remove(self._journal_path)
+
+    # -- updates -----------------------------------------------------------
+
+    def cell_means(self, values: np.ndarray, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Average (days, lat, lon) source grids into (days, lat cells, lon cells); empty cells are NaN"""
+        rows = np.floor((lats - self.region['lat_min']) / self.resolution).astype(np.int64)
+        cols = np.floor((lons - self.region['lon_min']) / self.resolution).astype(np.int64)
+        # Points on the far edge belong to the last cell
+        rows[lats == self.region['lat_max']] = self.lat_cells - 1
+        cols[lons == self.region['lon_max']] = self.lon_cells - 1
+        inside = ((rows >= 0) & (rows < self.lat_cells))[:, None] & ((cols >= 0) & (cols < self.lon_cells))[None, :]
+        cells = rows[:, None] * self.lon_cells + cols[None, :]
+
+        n_cells = self.lat_cells * self.lon_cells
+        days = values.shape[0]
+        ok = inside[None, :, :] & np.isfinite(values)
+        index = (np.arange(days)[:, None, None] * n_cells + cells[None, :, :])[ok]
+        sums = np.bincount(index, weights=values[ok], minlength=days * n_cells)
+        counts = np.bincount(index, minlength=days * n_cells)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        return means.reshape(days, self.lat_cells, self.lon_cells)
+
+    def ingest(self, dates: List[Date], grids: np.ndarray) -> Tuple[int, int]:
+        """Fold daily cell grids into the tables, skipping dates already ingested
+
+        Returns (ingested, skipped).
+        """
+        with self._locked():
+            # Another process may have ingested since we last looked, or died part way through
+            meta = self._read_meta()
+            self._recover(meta)
+            self._ingested = set(meta['ingested'])
+            pending = {}
+            for day, grid in zip(dates, grids):
+                if day.isoformat() not in self._ingested:
+                    pending.setdefault(day, grid)
+            skipped = len(dates) - len(pending)
+            if not pending:
+                return 0, skipped
+
+            self._write_journal(list(pending))
+            for day, grid in pending.items():
+                grid = grid.astype(np.float32)
+                self.day_of_year.add(day_slot(day), grid)
+                self.monthly.add(day.month - 1, grid)
+                ordinal = day.toordinal()
+                slot = ordinal % self.recent_days
+                if ordinal >= self.recent_dates[slot]:
+                    self.recent[slot] = grid
+                    self.recent_dates[slot] = ordinal
+            self._flush()
+            meta['ingested'] = sorted(self._ingested | {day.isoformat() for day in pending})
+            self._write_meta(meta)
+            self._ingested = set(meta['ingested'])
+            os.remove(self._journal_path)
+        return len(pending), skipped
+
+    # -- queries -----------------------------------------------------------
+
+    def locate(self, lat: float, lon: float) -> Tuple[int, int]:
+        row = int((lat - self.region['lat_min']) // self.resolution)
+        col = int((lon - self.region['lon_min']) // self.resolution)
+        row = self.lat_cells - 1 if lat == self.region['lat_max'] else row
+        col = self.lon_cells - 1 if lon == self.region['lon_max'] else col
+        if not (0 <= row < self.lat_cells and 0 <= col < self.lon_cells):
+            raise ClimatologyError(
+                f"({lat}, {lon}) is outside the climatology region {self.region}")
+        return row, col
+
+    def cell_center(self, row: int, col: int) -> Dict[str, float]:
+        return {'lat': self.region['lat_min'] + (row + 0.5) * self.resolution,
+                'lon': self.region['lon_min'] + (col + 0.5) * self.resolution}
+
+    def observed(self, dates: List[Date], row: int, col: int) -> np.ndarray:
+        """Ingested observations for a cell on `dates` that are still in the recent buffer"""
+        ordinals = np.array([day.toordinal() for day in dates], dtype=np.int64)
+        slots = ordinals % self.recent_days
+        values = self.recent[slots, row, col].astype(np.float64)
+        ok = (self.recent_dates[slots] == ordinals) & np.isfinite(values)
+        return values[ok]
+
+    @property
+    def days_ingested(self) -> int:
+        return len(self._ingested)
+
+    def coverage(self) -> Dict[str, Any]:
+        ingested = sorted(self._ingested)
+        return {
+            'days_ingested': len(ingested),
+            'first_day': ingested[0] if ingested else None,
+            'last_day': ingested[-1] if ingested else None,
+            'grid': {**self.region, 'resolution': self.resolution,
+                     'lat_cells': self.lat_cells, 'lon_cells': self.lon_cells}
+        }
+
+
+def _compare(observed: float, baseline: Dict[str, Any]) -> Dict[str, Any]:
+    if baseline['mean'] is None:
+        return {**baseline, 'anomaly': None, 'z_score': None}
+    anomaly = observed - baseline['mean']
+    z_score = anomaly / baseline['std'] if baseline['std'] else None
+    return {**baseline, 'anomaly': anomaly, 'z_score': z_score}
+
+
+class Climatology:
+    """Climatology stores for every supported variable, plus ingestion from NASA data"""
+
+    def __init__(self,
+                 nasa_data=None,
+                 directory: str = None,
+                 region: Dict[str, float] = None,
+                 resolution: float = None,
+                 recent_days: int = None):
+        self._nasa_data = nasa_data
+        self.directory = directory or os.getenv('CLIMATOLOGY_DIR', 'data/climatology')
+        self.region = region or _region_from_env()
+        self.resolution = resolution or float(os.getenv('CLIMATOLOGY_RESOLUTION', '1.0'))
+        self.recent_days = recent_days or int(os.getenv('CLIMATOLOGY_RECENT_DAYS', '62'))
+        self._stores: Dict[str, ClimatologyStore] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def nasa_data(self):
+        if self._nasa_data is None:
+            from nasa_data import nasa_data
+            self._nasa_data = nasa_data
+        return self._nasa_data
+
+    def store(self, variable: str) -> ClimatologyStore:
+        if variable not in VARIABLES:
+            raise ClimatologyError(f"Unknown variable '{variable}'. Available: {', '.join(VARIABLES)}")
+        with self._lock:
+            if variable not in self._stores:
+                self._stores[variable] = ClimatologyStore(
+                    os.path.join(self.directory, variable), self.region, self.resolution, self.recent_days)
+            return self._stores[variable]
+
+    # -- ingestion ---------------------------------------------------------
+
+    def _load(self, variable: str, start: Date, end: Date):
+        """Source dataset for the whole climatology region between two dates"""
+        spec = VARIABLES[variable]
+        if spec['source'] == 'gpm':
+            return self.nasa_data.open_gpm_dataset(
+                start.isoformat(), end.isoformat(),
+                (self.region['lat_min'], self.region['lat_max']), (self.region['lon_min'], self.region['lon_max']))
+        return self.nasa_data.open_modis_dataset(
+            spec['product'], start.isoformat(), self.region, days=(end - start).days + 1)
+
+    async def ingest(self, variable: str, start_date: str, end_date: str) -> Dict[str, Any]:
+        """Add daily grids between two dates (inclusive) to a variable's tables
+
+        Blocking despite being a coroutine, like the NASA access methods; the
+        job runner gives it a pool thread.
+        """
+        try:
+            store = self.store(variable)
+            start, end = _parse_date(start_date, 'start_date'), _parse_date(end_date, 'end_date')
+            dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+            pending = [day for day in dates if day.isoformat() not in store._ingested]
+            ingested = 0
+            if pending:
+                ds = self._load(variable, pending[0], pending[-1])
+                field = ds[VARIABLES[variable]['field']]
+                grids = store.cell_means(field.values, ds['lat'].values, ds['lon'].values)
+                loaded = [t.astype('datetime64[D]').item() for t in ds['time'].values]
+                ingested, _ = store.ingest(loaded, grids)
+            logger.info(f"Climatology {variable}: ingested {ingested} of {len(dates)} days {start_date}..{end_date}")
+            return {'success': True,
+                    'statistics': {'days_requested': len(dates), 'days_ingested': ingested,
+                                   'days_skipped': len(dates) - ingested}}
+        except Exception as e:
+            logger.error(f"Climatology ingest for {variable} failed: {e}")
+            return {'error': str(e), 'success': False}
+
+    # -- queries -----------------------------------------------------------
+
+    def anomaly(self, variable: str, lat: float, lon: float, date: str,
+                days: int = 1, value: Optional[float] = None) -> Dict[str, Any]:
+        """How the `days` ending on `date` compare with the climatology of the cell containing (lat, lon)
+
+        The observation is the mean of the ingested days in the window unless
+        `value` is given. Window days are left out of the normals they are
+        compared with; `count` reports how many days the normals rest on.
+        Z-scores use the spread of single days.
+        """
+        store = self.store(variable)
+        end = _parse_date(date, 'date')
+        if not 1 <= days <= 366:
+            raise ClimatologyError("days must be between 1 and 366")
+        row, col = store.locate(lat, lon)
+        dates = [end - timedelta(days=i) for i in range(days - 1, -1, -1)]
+
+        window = store.observed(dates, row, col)
+        if value is None:
+            if not len(window):
+                raise ClimatologyError(
+                    f"No {variable} observations between {dates[0]} and {end}; ingest them or pass a value")
+            value, observed_days = float(window.mean()), len(window)
+        else:
+            observed_days = None
+
+        day_of_year = store.day_of_year.pooled(sorted({day_slot(day) for day in dates}), row, col, exclude=window)
+        monthly = store.monthly.pooled(sorted({day.month - 1 for day in dates}), row, col, exclude=window)
+        return {
+            'variable': variable,
+            'units': VARIABLES[variable]['units'],
+            'cell': store.cell_center(row, col),
+            'window': {'start': dates[0].isoformat(), 'end': end.isoformat(), 'days': days},
+            'observed': value,
+            'observed_days': observed_days,
+            'excluded_days': len(window),
+            'day_of_year': _compare(value, day_of_year),
+            'monthly': _compare(value, monthly),
+            'percent_of_normal': value / day_of_year['mean'] * 100 if day_of_year['mean'] else None
+        }
+
+    def normals(self, variable: str, lat: float, lon: float) -> Dict[str, Any]:
+        """Monthly climatology of the cell containing (lat, lon)"""
+        store = self.store(variable)
+        row, col = store.locate(lat, lon)
+        return {
+            'variable': variable,
+            'units': VARIABLES[variable]['units'],
+            'cell': store.cell_center(row, col),
+            'months': [{'month': month + 1, **store.monthly.pooled([month], row, col)} for month in range(12)]
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'days_ingested': {name: store.days_ingested for name, store in self._stores.items()}}
+
+    def get_coverage(self) -> Dict[str, Any]:
+        return {name: self.store(name).coverage() for name in VARIABLES}
+
+
+# Global instance
+climatology = Climatology()
@@ -99,6 +99,7 @@ class NASACredentials:
             import aiohttp
             import asyncio
             import base64
+            from metrics import track_upstream
             
             async def test_auth():
                 # Create basic auth header
@@ -110,12 +111,14 @@ class NASACredentials:
                 auth_url = f"{self.opendap_urls['earthdata']}/oauth/authorize"
                 
                 async with aiohttp.ClientSession() as session:
-                    async with session.get(auth_url, headers=headers, timeout=10, allow_redirects=False) as response:
-                        return {
-                            'valid': response.status in [200, 302],
-                            'status_code': response.status,
-                            'message': 'Credentials are valid' if response.status in [200, 302] else 'Invalid credentials'
-                        }
+                    with track_upstream('earthdata') as call:
+                        async with session.get(auth_url, headers=headers, timeout=10, allow_redirects=False) as response:
+                            call.finish(response.status)
+                            return {
+                                'valid': response.status in [200, 302],
+                                'status_code': response.status,
+                                'message': 'Credentials are valid' if response.status in [200, 302] else 'Invalid credentials'
+                            }
             
             # Run the async test
             loop = asyncio.new_event_loop()
@@ -0,0 +1,476 @@
+"""
+NASA Analysis Jobs
+Runs long GPM/MODIS region and time-range analyses chunk by chunk outside the request cycle
+
+Jobs are identified by a hash of their kind and parameters, so duplicate
+submissions share one job. Each finished chunk is checkpointed to disk and a
+restarted job resumes from its last checkpoint. Final results go to a result
+store shared by every worker on the host (SQLite next to the checkpoints by
+default) with an expiry.
+"""
+
+import os
+import json
+import fcntl
+import time
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache_backends import CacheBackend, create_cache_backend
+from climatology import VARIABLES as CLIMATOLOGY_VARIABLES
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = ('completed', 'failed')
+
+# How often finished jobs past their result TTL are forgotten
+PRUNE_INTERVAL = 60
+
+
+class JobError(Exception):
+    """Raised for invalid job submissions"""
+
+
+def _parse_date(value: str, field: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise JobError(f"{field} must be a YYYY-MM-DD date")
+
+
+def _date_chunks(start: datetime, end: datetime, days: int) -> List[Tuple[str, str]]:
+    chunks = []
+    while start <= end:
+        chunk_end = min(end, start + timedelta(days=days - 1))
+        chunks.append((start.strftime("%Y-%m-%d"), chunk_end.strftime("%Y-%m-%d")))
+        start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+class JobKind:
+    """How to validate, split, run and merge one kind of analysis"""
+
+    def __init__(self,
+                 normalize: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 plan: Callable[[Dict[str, Any]], List[Dict[str, Any]]],
+                 run_chunk: Callable[[Dict[str, Any]], Any],
+                 merge: Callable[[Dict[str, Any], List[Dict[str, Any]]], Dict[str, Any]]):
+        self.normalize = normalize
+        self.plan = plan
+        self.run_chunk = run_chunk
+        self.merge = merge
+
+
+def _gpm_kind(nasa_data, chunk_days: int) -> JobKind:
+    def normalize(params: Dict[str, Any]) -> Dict[str, Any]:
+        start = _parse_date(params.get('start_date'), 'start_date')
+        end = _parse_date(params.get('end_date'), 'end_date')
+        if end < start:
+            raise JobError("end_date must not be before start_date")
+        try:
+            lat_range = [float(v) for v in params.get('lat_range', (20, 50))]
+            lon_range = [float(v) for v in params.get('lon_range', (-130, -60))]
+        except (TypeError, ValueError):
+            lat_range = lon_range = []
+        if len(lat_range) != 2 or len(lon_range) != 2:
+            raise JobError("lat_range and lon_range must be numeric [min, max] pairs")
+        return {'start_date': start.strftime("%Y-%m-%d"), 'end_date': end.strftime("%Y-%m-%d"),
+                'lat_range': lat_range, 'lon_range': lon_range}
+
+    def plan(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        start, end = _parse_date(params['start_date'], 'start_date'), _parse_date(params['end_date'], 'end_date')
+        return [{**params, 'start_date': s, 'end_date': e} for s, e in _date_chunks(start, end, chunk_days)]
+
+    def run_chunk(chunk: Dict[str, Any]):
+        return nasa_data.get_gpm_precipitation_data(
+            chunk['start_date'], chunk['end_date'], tuple(chunk['lat_range']), tuple(chunk['lon_range']))
+
+    def merge(params: Dict[str, Any], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        stats = [r['statistics'] for r in results]
+        days = [s['temporal_coverage']['duration_days'] for s in stats]
+        return {
+            'params': params,
+            'statistics': {
+                'mean_precipitation': sum(s['mean_precipitation'] * d for s, d in zip(stats, days)) / sum(days),
+                'max_precipitation': max(s['max_precipitation'] for s in stats),
+                'total_precipitation': sum(s['total_precipitation'] for s in stats),
+                'spatial_coverage': stats[0]['spatial_coverage'],
+                'temporal_coverage': {
+                    'start': stats[0]['temporal_coverage']['start'],
+                    'end': stats[-1]['temporal_coverage']['end'],
+                    'duration_days': sum(days)
+                }
+            },
+            'chunks': len(results)
+        }
+
+    return JobKind(normalize, plan, run_chunk, merge)
+
+
+def _modis_kind(nasa_data) -> JobKind:
+    # One chunk per 16-day composite period; the last one is clipped to end_date
+    window = 16
+
+    def normalize(params: Dict[str, Any]) -> Dict[str, Any]:
+        start = _parse_date(params.get('start_date'), 'start_date')
+        end = _parse_date(params.get('end_date', params.get('start_date')), 'end_date')
+        if end < start:
+            raise JobError("end_date must not be before start_date")
+        region = params.get('region') or {'lat_min': 25, 'lat_max': 50, 'lon_min': -125, 'lon_max': -65}
+        try:
+            region = {key: float(region[key]) for key in ('lat_min', 'lat_max', 'lon_min', 'lon_max')}
+        except (KeyError, TypeError, ValueError):
+            raise JobError("region needs numeric lat_min, lat_max, lon_min and lon_max")
+        return {'product': str(params.get('product', 'MOD11A1')), 'start_date': start.strftime("%Y-%m-%d"),
+                'end_date': end.strftime("%Y-%m-%d"), 'region': region}
+
+    def plan(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        start, end = _parse_date(params['start_date'], 'start_date'), _parse_date(params['end_date'], 'end_date')
+        return [{**params, 'start_date': s, 'days': (_parse_date(e, 'end_date') - _parse_date(s, 'start_date')).days + 1}
+                for s, e in _date_chunks(start, end, window)]
+
+    def run_chunk(chunk: Dict[str, Any]):
+        return nasa_data.get_modis_data(chunk['product'], chunk['start_date'], chunk['region'],
+                                        chunk.get('days', window))
+
+    def merge(params: Dict[str, Any], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Chunks share one grid, so each one's weight is its number of days
+        days = [r.get('days') or window for r in results]
+        total = sum(days)
+        statistics = {}
+        for var in results[0]['statistics']:
+            parts = [r['statistics'][var] for r in results]
+            mean = sum(p['mean'] * d for p, d in zip(parts, days)) / total
+            second_moment = sum((p['std'] ** 2 + p['mean'] ** 2) * d for p, d in zip(parts, days)) / total
+            statistics[var] = {
+                'mean': mean,
+                'std': max(0.0, second_moment - mean ** 2) ** 0.5,
+                'min': min(p['min'] for p in parts),
+                'max': max(p['max'] for p in parts)
+            }
+        end = _parse_date(params['start_date'], 'start_date') + timedelta(days=total - 1)
+        return {
+            'params': params,
+            'product': params['product'],
+            'statistics': statistics,
+            'temporal_coverage': {'start': params['start_date'], 'end': end.strftime("%Y-%m-%d"), 'duration_days': total},
+            'chunks': len(results)
+        }
+
+    return JobKind(normalize, plan, run_chunk, merge)
+
+
+def _climatology_kind(climatology, chunk_days: int) -> JobKind:
+    def normalize(params: Dict[str, Any]) -> Dict[str, Any]:
+        variable = params.get('variable', 'precipitation')
+        if variable not in CLIMATOLOGY_VARIABLES:
+            raise JobError(f"Unknown variable '{variable}'. Available: {', '.join(CLIMATOLOGY_VARIABLES)}")
+        start = _parse_date(params.get('start_date'), 'start_date')
+        end = _parse_date(params.get('end_date', params.get('start_date')), 'end_date')
+        if end < start:
+            raise JobError("end_date must not be before start_date")
+        return {'variable': variable, 'start_date': start.strftime("%Y-%m-%d"), 'end_date': end.strftime("%Y-%m-%d")}
+
+    def plan(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        start, end = _parse_date(params['start_date'], 'start_date'), _parse_date(params['end_date'], 'end_date')
+        return [{**params, 'start_date': s, 'end_date': e} for s, e in _date_chunks(start, end, chunk_days)]
+
+    def run_chunk(chunk: Dict[str, Any]):
+        return climatology.ingest(chunk['variable'], chunk['start_date'], chunk['end_date'])
+
+    def merge(params: Dict[str, Any], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        totals = {key: sum(r['statistics'][key] for r in results)
+                  for key in ('days_requested', 'days_ingested', 'days_skipped')}
+        return {'params': params, 'statistics': totals, 'chunks': len(results)}
+
+    return JobKind(normalize, plan, run_chunk, merge)
+
+
+class JobManager:
+    """Queues analysis jobs and runs their chunks on a local thread pool"""
+
+    def __init__(self,
+                 result_store: CacheBackend = None,
+                 nasa_data=None,
+                 checkpoint_dir: str = None,
+                 workers: int = None,
+                 result_ttl: float = None,
+                 chunk_days: int = None,
+                 climatology=None):
+        if nasa_data is None:
+            from nasa_data import nasa_data
+        if climatology is None:
+            from climatology import climatology
+        self.checkpoint_dir = checkpoint_dir or os.getenv('JOB_CHECKPOINT_DIR', 'data/jobs')
+        self._owns_result_store = result_store is None
+        self.result_store = result_store or create_cache_backend(
+            os.getenv('JOB_RESULT_URL') or f"sqlite:///{os.path.join(self.checkpoint_dir, 'results.db')}")
+        self.workers = workers or int(os.getenv('JOB_WORKERS', '2'))
+        self.result_ttl = result_ttl or float(os.getenv('JOB_RESULT_TTL', '86400'))
+        chunk_days = chunk_days or int(os.getenv('JOB_CHUNK_DAYS', '7'))
+        self.kinds: Dict[str, JobKind] = {
+            'gpm_precipitation': _gpm_kind(nasa_data, chunk_days),
+            'modis': _modis_kind(nasa_data),
+            'climatology_ingest': _climatology_kind(climatology, chunk_days),
+        }
+
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        # Open, flock'ed run-lock descriptors of the jobs this process owns
+        self._locks: Dict[str, int] = {}
+        self._pruned_at = 0.0
+
+    # -- lifecycle ---------------------------------------------------------
+
+    async def start(self):
+        """Start workers and resume any unfinished checkpointed jobs"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='nasa-job')
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+        self._prune()
+        for name in sorted(os.listdir(self.checkpoint_dir)):
+            if not name.endswith('.json'):
+                continue
+            job = self._load_checkpoint(name[:-len('.json')])
+            if job and job['status'] not in TERMINAL_STATES and self._claim(job['id']):
+                logger.info(f"Resuming job {job['id']} at chunk {len(job['chunk_results'])}/{job['chunks_total']}")
+                job['status'] = 'queued'
+                self.jobs[job['id']] = job
+                self._queue.put_nowait(job['id'])
+
+    async def stop(self):
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        for job_id, job in self.jobs.items():
+            if job['status'] not in TERMINAL_STATES:
+                self._release(job_id)
+        if self._owns_result_store:
+            await self.result_store.close()
+
+    # -- public API --------------------------------------------------------
+
+    async def submit(self, kind: str, params: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """Queue a job, or return the existing one for identical parameters
+
+        Returns (status, deduplicated).
+        """
+        if kind not in self.kinds:
+            raise JobError(f"Unknown job kind '{kind}'. Available: {', '.join(self.kinds)}")
+        params = self.kinds[kind].normalize(params or {})
+        if time.time() - self._pruned_at >= PRUNE_INTERVAL:
+            self._prune()
+        job_id = hashlib.sha256(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()[:24]
+
+        existing = self.jobs.get(job_id) or self._load_checkpoint(job_id)
+        if existing is not None:
+            if existing['status'] == 'completed':
+                if await self.result_store.get(self._result_key(job_id)) is not None:
+                    return self._public(existing), True
+                # The result expired; compute it again
+                existing = None
+            elif existing['status'] != 'failed' and job_id in self.jobs:
+                return self._public(existing), True
+
+        if existing is not None:
+            # Failed, or orphaned by a process that died: resume from the last checkpoint
+            job = existing
+        else:
+            chunks = self.kinds[kind].plan(params)
+            job = {
+                'id': job_id, 'kind': kind, 'params': params, 'status': 'queued',
+                'chunks': chunks, 'chunks_total': len(chunks), 'chunk_results': {},
+                'created': time.time(), 'updated': time.time(), 'error': None
+            }
+        if not self._claim(job_id):
+            # Another live worker process on this host is running it
+            return self._public(job), True
+        job.update(status='queued', error=None, updated=time.time())
+        self.jobs[job_id] = job
+        self._save_checkpoint(job)
+        self._queue.put_nowait(job_id)
+        return self._public(job), False
+
+    def get_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id) or self._load_checkpoint(job_id)
+        return self._public(job) if job else None
+
+    async def get_result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.result_store.get(self._result_key(job_id))
+
+    async def stream_status(self, job_id: str, interval: float = 0.5):
+        """Yield the job status whenever it changes, until it finishes"""
+        last = None
+        while True:
+            status = self.get_status(job_id)
+            if status is None:
+                return
+            snapshot = (status['status'], status['chunks_done'])
+            if snapshot != last:
+                last = snapshot
+                yield status
+            if status['status'] in TERMINAL_STATES:
+                return
+            await asyncio.sleep(interval)
+
+    def get_stats(self) -> Dict[str, Any]:
+        by_status: Dict[str, int] = {}
+        for job in self.jobs.values():
+            by_status[job['status']] = by_status.get(job['status'], 0) + 1
+        return {'queued': self._queue.qsize() if self._queue else 0, 'jobs': by_status}
+
+    # -- execution ---------------------------------------------------------
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] in TERMINAL_STATES:
+                continue
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}")
+                job.update(status='failed', error=str(e), updated=time.time())
+                self._save_checkpoint(job)
+                self._release(job_id)
+
+    async def _run(self, job: Dict[str, Any]):
+        kind = self.kinds[job['kind']]
+        loop = asyncio.get_running_loop()
+        job.update(status='running', updated=time.time())
+        self._save_checkpoint(job)
+
+        for index, chunk in enumerate(job['chunks']):
+            if str(index) in job['chunk_results']:
+                continue
+            # NASA access methods are coroutines doing blocking work; give each chunk its own loop on a pool thread
+            result = await loop.run_in_executor(self._executor, asyncio.run, kind.run_chunk(chunk))
+            if not result.get('success'):
+                raise RuntimeError(result.get('error', 'chunk failed'))
+            # Only the statistics (and chunk length) are needed for merging; keep checkpoints small
+            job['chunk_results'][str(index)] = {'statistics': result['statistics'], 'days': chunk.get('days')}
+            job['updated'] = time.time()
+            self._save_checkpoint(job)
+
+        ordered = [job['chunk_results'][str(i)] for i in range(job['chunks_total'])]
+        result = kind.merge(job['params'], ordered)
+        await self.result_store.set(self._result_key(job['id']), result, ttl=self.result_ttl)
+
+        # The result store holds the output now; keep only the lightweight status on disk
+        job.update(status='completed', updated=time.time(), chunk_results={}, completed=time.time())
+        self._save_checkpoint(job)
+        self._release(job['id'])
+        logger.info(f"Job {job['id']} completed ({job['chunks_total']} chunks)")
+
+    def _prune(self):
+        """Forget finished jobs whose results have expired, in memory and on disk"""
+        now = time.time()
+        self._pruned_at = now
+        cutoff = now - self.result_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job['status'] in TERMINAL_STATES and job['updated'] < cutoff]:
+            del self.jobs[job_id]
+
+        for name in os.listdir(self.checkpoint_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                # Checkpoints are rewritten on every change, so only old files can be expired jobs
+                if os.path.getmtime(os.path.join(self.checkpoint_dir, name)) >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            job = self._load_checkpoint(name[:-len('.json')])
+            if job and job['status'] in TERMINAL_STATES and job['updated'] < cutoff:
+                try:
+                    os.remove(self._path(job['id']))
+                except FileNotFoundError:
+                    pass
+
+    # -- persistence -------------------------------------------------------
+
+    @staticmethod
+    def _result_key(job_id: str) -> str:
+        return f"job-result:{job_id}"
+
+    def _path(self, job_id: str, suffix: str = '.json') -> str:
+        return os.path.join(self.checkpoint_dir, f"{job_id}{suffix}")
+
+    def _save_checkpoint(self, job: Dict[str, Any]):
+        tmp = self._path(job['id'], '.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(job, f, default=str)
+        os.replace(tmp, self._path(job['id']))
+
+    def _load_checkpoint(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _claim(self, job_id: str) -> bool:
+        """Take the host-wide run lock for a job
+
+        The lock is an flock on a descriptor held until the job finishes; the
+        kernel drops it when the owning process dies, so a crashed job can
+        always be claimed again.
+        """
+        if job_id in self._locks:
+            return True
+        path = self._path(job_id, '.lock')
+        while True:
+            fd = os.open(path, os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            # The previous owner may have removed the file between our open and flock
+            try:
+                if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                    self._locks[job_id] = fd
+                    return True
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _release(self, job_id: str):
+        fd = self._locks.pop(job_id, None)
+        if fd is None:
+            return
+        try:
+            os.remove(self._path(job_id, '.lock'))
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        done = len(job.get('chunk_results', {})) if job['status'] != 'completed' else job['chunks_total']
+        return {
+            'job_id': job['id'],
+            'kind': job['kind'],
+            'params': job['params'],
+            'status': job['status'],
+            'chunks_done': done,
+            'chunks_total': job['chunks_total'],
+            'progress': round(done / job['chunks_total'], 4) if job['chunks_total'] else 1.0,
+            'created': job['created'],
+            'updated': job['updated'],
+            'error': job.get('error')
+        }
@@ -1,23 +1,46 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 import os
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 import aiohttp
 import asyncio
-import random
+import json
+import secrets
+import threading
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+from weather_hub import WeatherHub, SubscriptionLimitError, location_key
+from quota import quota_manager, Priority, QuotaExceededError
+from cache_backends import create_cache_backend
+from metrics import (
+    MetricsMiddleware, UpstreamCall, monitor_event_loop_lag, record_mock_fallback,
+    render_metrics, stats_collector, sync_stats_counters, timed_span
+)
+from mock_weather import mock_timeline
+from jobs import JobError, JobManager
+from climatology import ClimatologyError, climatology
+from profiling import ProfilerBusyError, SlowRequestMiddleware, profiler, slow_request_monitor
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="ForeTrip API", description="Clean weather API backend for ForeTrip")
 
+# Upstream weather responses, shared by all workers when CACHE_URL points at a shared backend.
+# Entries are served directly while fresh and kept longer as a fallback when the budget runs low.
+WEATHER_CACHE_TTL = float(os.getenv('WEATHER_CACHE_TTL', '120'))
+WEATHER_STALE_TTL = float(os.getenv('WEATHER_STALE_TTL', '86400'))
+weather_cache = create_cache_backend()
+
 # Enable CORS for Expo app
 # Get allowed origins from environment variable, default to allow all for development
 ALLOWED_ORIGINS = os.getenv('ALLOWED_ORIGINS', '*')
@@ -33,6 +56,33 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Responses that stay open until a job finishes; their duration says nothing about latency
+STREAMING_ROUTES = ('/nasa/jobs/{job_id}/events',)
+app.add_middleware(MetricsMiddleware, exclude_routes=STREAMING_ROUTES)
+app.add_middleware(SlowRequestMiddleware, monitor=slow_request_monitor, exclude_routes=STREAMING_ROUTES)
+
+# Visual Crossing endpoint; overridable so benchmarks can point at a local stand-in
+VISUAL_CROSSING_BASE_URL = os.getenv(
+    'VISUAL_CROSSING_BASE_URL', 'https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services'
+).rstrip('/')
+
+# Token for /admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+@app.on_event("startup")
+async def start_weather_hub():
+    await weather_hub.start()
+    await job_manager.start()
+    app.state.loop_lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    app.state.stats_sync = asyncio.create_task(sync_stats_counters())
+
+@app.on_event("shutdown")
+async def stop_weather_hub():
+    app.state.loop_lag_monitor.cancel()
+    app.state.stats_sync.cancel()
+    await weather_hub.stop()
+    await job_manager.stop()
+    await weather_cache.close()
 
 @app.get("/")
 async def root():
@@ -47,6 +97,48 @@ async def health_check():
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Reject requests without the configured admin token"""
+    # Compared as bytes: compare_digest rejects non-ASCII str, and headers arrive decoded as latin-1
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(
+            x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_worker(seconds: float = 10, interval: float = 0.01, all_threads: bool = False):
+    """
+    Sample this worker's stacks for `seconds` and return them in folded format
+    (one `frame;frame;frame count` line per stack) for flamegraph.pl or speedscope
+    """
+    loop_thread = None if all_threads else threading.get_ident()
+    try:
+        result = await asyncio.to_thread(profiler.profile, seconds, max(interval, 0.001), loop_thread)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(
+        profiler.folded(result),
+        headers={'X-Profile-Samples': str(result['samples']), 'X-Profile-Seconds': str(result['seconds'])}
+    )
+
+@app.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+async def slow_requests():
+    """Recent requests slower than SLOW_REQUEST_THRESHOLD with their stacks and span breakdown"""
+    return {
+        'threshold': slow_request_monitor.threshold,
+        'requests': slow_request_monitor.get_reports()
+    }
+
+@app.get("/quota")
+async def quota_status():
+    """Visual Crossing query budget usage"""
+    return {**quota_manager.get_stats(), 'cache': weather_cache.get_stats()}
+
 @app.get("/geocode")
 async def geocode_location(q: str):
     """
@@ -59,8 +151,15 @@ async def geocode_location(q: str):
             logger.warning("API key not configured, returning mock geocoding data")
             return generate_mock_geocoding_data(q)
         
+        try:
+            charged = await quota_manager.acquire(Priority.INTERACTIVE)
+        except QuotaExceededError as e:
+            logger.warning(f"Geocoding skipped, {e}")
+            quota_manager.record_degraded()
+            return generate_mock_geocoding_data(q)
+        
         # Visual Crossing geocoding endpoint
-        url = f"https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/{q}"
+        url = f"{VISUAL_CROSSING_BASE_URL}/timeline/{q}"
         
         params = {
             'key': API_KEY,
@@ -69,11 +168,14 @@ async def geocode_location(q: str):
             'elements': 'latitude,longitude,address,resolvedAddress'
         }
         
+        call = UpstreamCall('visual_crossing')
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
                     if response.status == 200:
                         data = await response.json()
+                        call.finish(response.status)
+                        await quota_manager.record(charged, data.get('queryCost'))
                         # Format response to match expected frontend format
                         results = [{
                             "lat": data.get("latitude"),
@@ -84,9 +186,15 @@ async def geocode_location(q: str):
                         }]
                         return {"results": results}
                     else:
+                        call.finish(response.status)
+                        await quota_manager.refund(charged)
                         logger.error(f"Geocoding API error: {response.status}")
                         return generate_mock_geocoding_data(q)
         except Exception as e:
+            if not call.finished:
+                # Failed before a response was read, so nothing reported a cost
+                await quota_manager.refund(charged)
+            call.finish('timeout' if isinstance(e, asyncio.TimeoutError) else 'error')
             logger.error(f"Geocoding request error: {e}")
             return generate_mock_geocoding_data(q)
             
@@ -105,6 +213,16 @@ async def get_weather_data(
     Get comprehensive weather data for a specific location using Visual Crossing Weather API format
     Supports both current weather and historical/forecast data with date parameter
     """
+    data = await fetch_weather_data(lat, lon, location_name, date)
+    with timed_span('serialize'):
+        return JSONResponse(content=data)
+
+async def fetch_weather_data(lat: float, lon: float, location_name: str, date: str = None,
+                             priority: Priority = Priority.INTERACTIVE, max_age: float = None):
+    """Fetch weather data from Visual Crossing, falling back to cached or mock data on any failure
+
+    Cached responses younger than `max_age` seconds (default WEATHER_CACHE_TTL) are served as fresh.
+    """
     try:
         # Visual Crossing API key
         API_KEY = os.getenv('VISUAL_CROSSING_API_KEY', 'YOUR_API_KEY_HERE')
@@ -112,10 +230,10 @@ async def get_weather_data(
         # Build Visual Crossing Weather API endpoint with optional date
         if date:
             # Format: YYYY-MM-DD for specific date, or date range YYYY-MM-DD/YYYY-MM-DD
-            url = f"https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/{lat},{lon}/{date}"
+            url = f"{VISUAL_CROSSING_BASE_URL}/timeline/{lat},{lon}/{date}"
         else:
             # Current weather and 7-day forecast
-            url = f"https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline/{lat},{lon}"
+            url = f"{VISUAL_CROSSING_BASE_URL}/timeline/{lat},{lon}"
         
         params = {
             'key': API_KEY,
@@ -129,29 +247,199 @@ async def get_weather_data(
             logger.warning("Visual Crossing API key not configured, returning mock data")
             return generate_mock_visual_crossing_data(lat, lon, location_name, date)
         
+        cache_key = f"weather:{location_key(lat, lon)}/{date or 'current'}"
+        cached = await weather_cache.get(cache_key)
+        if cached is not None and time.time() - cached['fetched_at'] < (WEATHER_CACHE_TTL if max_age is None else max_age):
+            return for_request(cached['data'], lat, lon, location_name)
+        
+        # Spare the budget when it is tight and we already have an answer
+        if cached is not None and quota_manager.is_tight(priority):
+            logger.warning("Quota budget tight, serving cached weather data")
+            quota_manager.record_degraded()
+            return fallback_weather_data(cached, lat, lon, location_name, date)
+        
+        try:
+            charged = await quota_manager.acquire(priority)
+        except QuotaExceededError as e:
+            logger.warning(f"Visual Crossing request skipped, {e}")
+            quota_manager.record_degraded()
+            return fallback_weather_data(cached, lat, lon, location_name, date)
+        
         # Make request to Visual Crossing API
+        call = UpstreamCall('visual_crossing')
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=10)) as response:
                     if response.status == 200:
                         data = await response.json()
-                        return format_visual_crossing_response(data, location_name, lat, lon)
+                        call.finish(response.status)
+                        await quota_manager.record(charged, data.get('queryCost'))
+                        with timed_span('format_response'):
+                            result = format_visual_crossing_response(data, location_name, lat, lon)
+                        await weather_cache.set(cache_key, {'data': result, 'fetched_at': time.time()}, ttl=WEATHER_STALE_TTL)
+                        return result
                     else:
+                        call.finish(response.status)
+                        await quota_manager.refund(charged)
                         logger.error(f"Visual Crossing API error: {response.status}")
-                        return generate_mock_visual_crossing_data(lat, lon, location_name)
+                        return fallback_weather_data(cached, lat, lon, location_name, date)
         except asyncio.TimeoutError:
+            if not call.finished:
+                await quota_manager.refund(charged)
+            call.finish('timeout')
             logger.error("Visual Crossing API timeout")
-            return generate_mock_visual_crossing_data(lat, lon, location_name)
+            return fallback_weather_data(cached, lat, lon, location_name, date)
         except Exception as e:
+            if not call.finished:
+                # Failed before a response was read, so nothing reported a cost
+                await quota_manager.refund(charged)
+            call.finish('error')
             logger.error(f"Visual Crossing API request error: {e}")
-            return generate_mock_visual_crossing_data(lat, lon, location_name)
+            return fallback_weather_data(cached, lat, lon, location_name, date)
                     
     except Exception as e:
         logger.error(f"Error fetching weather data: {e}")
         return generate_mock_visual_crossing_data(lat, lon, location_name, date)
 
+def for_request(data: dict, lat: float, lon: float, location_name: str):
+    """A cached response as this caller asked for it; entries are shared by everyone in the same 0.01° cell"""
+    return {**data, "latitude": lat, "longitude": lon, "address": f"{lat},{lon}", "resolvedAddress": location_name}
+
+def fallback_weather_data(cached: Optional[dict], lat: float, lon: float, location_name: str, date: str = None):
+    """Last good response for this location if we have one, otherwise mock data"""
+    if cached is not None:
+        return for_request(cached['data'], lat, lon, location_name)
+    return generate_mock_visual_crossing_data(lat, lon, location_name, date)
+
+class JobRequest(BaseModel):
+    kind: str
+    params: Dict[str, Any] = {}
+
+@app.post("/nasa/jobs", status_code=202)
+async def submit_nasa_job(request: JobRequest):
+    """
+    Queue a long-running NASA analysis ("gpm_precipitation" or "modis") or a
+    climatology update ("climatology_ingest").
+    Identical submissions return the existing job
+    """
+    try:
+        status, deduplicated = await job_manager.submit(request.kind, request.params)
+    except JobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**status, 'deduplicated': deduplicated}
+
+@app.get("/nasa/jobs/{job_id}")
+async def get_nasa_job(job_id: str):
+    """Job status and progress"""
+    status = job_manager.get_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return status
+
+@app.get("/nasa/jobs/{job_id}/events")
+async def stream_nasa_job(job_id: str):
+    """Server-sent events with the job status each time it progresses"""
+    if job_manager.get_status(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def events():
+        async for status in job_manager.stream_status(job_id):
+            yield f"event: progress\ndata: {json.dumps(status)}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={'Cache-Control': 'no-cache'})
+
+@app.get("/nasa/jobs/{job_id}/result")
+async def get_nasa_job_result(job_id: str):
+    """Result of a completed job; 202 while it is still running"""
+    status = job_manager.get_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if status['status'] == 'failed':
+        raise HTTPException(status_code=500, detail=status['error'])
+    if status['status'] != 'completed':
+        return JSONResponse(status_code=202, content=status)
+    result = await job_manager.get_result(job_id)
+    if result is None:
+        raise HTTPException(status_code=410, detail="Result expired; submit the job again")
+    return result
+
+@app.get("/climatology")
+async def climatology_coverage():
+    """Ingested days and grid of each climatology variable"""
+    return climatology.get_coverage()
+
+@app.get("/climatology/anomaly")
+async def climatology_anomaly(lat: float, lon: float, date: str, variable: str = "precipitation",
+                              days: int = 1, value: Optional[float] = None):
+    """
+    Compare the `days` ending on `date` (or a supplied value) with the day-of-year
+    and monthly climatology at a location
+    """
+    try:
+        return climatology.anomaly(variable, lat, lon, date, days, value)
+    except ClimatologyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/climatology/normals")
+async def climatology_normals(lat: float, lon: float, variable: str = "precipitation"):
+    """Monthly mean, spread and sample count at a location"""
+    try:
+        return climatology.normals(variable, lat, lon)
+    except ClimatologyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.websocket("/ws/weather")
+async def weather_subscription_feed(websocket: WebSocket):
+    """
+    Live weather feed. Clients send {"action": "subscribe", "lat": .., "lon": .., "location_name": ..}
+    or {"action": "unsubscribe", "location": key} and receive a snapshot followed by changed fields only
+    """
+    await websocket.accept()
+    subscriber = weather_hub.connect(websocket.send_json)
+    sender = asyncio.create_task(weather_hub.sender(subscriber))
+    receiver = asyncio.create_task(receive_subscriptions(websocket, subscriber))
+
+    done, pending = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    weather_hub.disconnect(subscriber)
+    for task in pending:
+        task.cancel()
+    for task in done:
+        if task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+            logger.error(f"Weather feed error: {task.exception()}")
+
+    if receiver not in done:
+        # The hub dropped this client (e.g. too slow to keep up)
+        try:
+            await websocket.close(code=1008)
+        except RuntimeError:
+            pass
+
+async def receive_subscriptions(websocket: WebSocket, subscriber):
+    """Apply subscribe/unsubscribe messages from a feed client"""
+    while True:
+        message = await websocket.receive_json()
+        action = message.get('action') if isinstance(message, dict) else None
+        try:
+            if action == 'subscribe':
+                await weather_hub.subscribe(
+                    subscriber,
+                    float(message['lat']),
+                    float(message['lon']),
+                    message.get('location_name', "Unknown Location")
+                )
+            elif action == 'unsubscribe':
+                weather_hub.unsubscribe(subscriber, message.get('location', ''))
+                weather_hub.enqueue(subscriber, {'type': 'unsubscribed', 'location': message.get('location')})
+            else:
+                weather_hub.enqueue(subscriber, {'type': 'error', 'message': f"Unknown action: {action}"})
+        except SubscriptionLimitError as e:
+            weather_hub.enqueue(subscriber, {'type': 'error', 'message': str(e)})
+        except (KeyError, TypeError, ValueError):
+            weather_hub.enqueue(subscriber, {'type': 'error', 'message': 'subscribe requires numeric lat and lon'})
+
 def generate_mock_geocoding_data(place_name: str):
     """Generate mock geocoding data for testing"""
+    record_mock_fallback('geocoding')
     # Simple mock data based on common place names
     mock_locations = {
         "new york": {"lat": 40.7128, "lon": -74.0060, "address": "New York, NY, USA", "country": "United States"},
@@ -193,107 +481,12 @@ def generate_mock_geocoding_data(place_name: str):
     return {"results": results}
 
 def generate_mock_visual_crossing_data(lat: float, lon: float, location_name: str, date: str = None):
-    """Generate realistic mock weather data in Visual Crossing format"""
-    
-    # Generate realistic temperature based on latitude and season
-    base_temp = 20 - (abs(lat) / 3)  # Cooler at higher latitudes
-    temp_variation = random.uniform(-5, 5)
-    temperature = round(base_temp + temp_variation, 1)
-    
-    # Generate other realistic values
-    humidity = random.randint(30, 90)
-    precip = round(random.uniform(0, 5), 1)
-    wind_speed = round(random.uniform(5, 25), 1)
-    wind_dir = random.randint(0, 359)
-    cloud_cover = random.randint(0, 100)
-    uv_index = max(0, random.randint(1, 11) - abs(lat) // 10)
-    visibility = round(random.uniform(10, 30), 1)
-    pressure = round(random.uniform(990, 1030), 1)
-    
-    # Determine conditions based on weather
-    if precip > 2:
-        conditions = "Rain"
-        description = "Rainy weather with precipitation"
-        icon = "rain"
-    elif cloud_cover > 80:
-        conditions = "Overcast"
-        description = "Overcast skies with heavy cloud cover"
-        icon = "cloudy"
-    elif cloud_cover > 50:
-        conditions = "Partly cloudy"
-        description = "Partly cloudy with some sun"
-        icon = "partly-cloudy"
-    else:
-        conditions = "Clear"
-        description = "Clear skies with plenty of sunshine"
-        icon = "clear"
-    
-    # Generate forecast for next 7 days
-    forecast_days = []
-    current_date = datetime.now()
-    
-    for i in range(7):
-        forecast_date = current_date + timedelta(days=i)
-        day_temp = temperature + random.uniform(-3, 3)
-        night_temp = day_temp - random.uniform(5, 10)
-        day_precip = round(random.uniform(0, 3), 1)
-        
-        if day_precip > 1:
-            day_conditions = "Rain"
-            day_icon = "rain"
-        elif random.choice([True, False]):
-            day_conditions = "Partly cloudy"
-            day_icon = "partly-cloudy"
-        else:
-            day_conditions = "Clear"
-            day_icon = "clear"
-        
-        forecast_days.append({
-            "datetime": forecast_date.strftime("%Y-%m-%d"),
-            "tempmax": round(day_temp, 1),
-            "tempmin": round(night_temp, 1),
-            "temp": round((day_temp + night_temp) / 2, 1),
-            "feelslike": round((day_temp + night_temp) / 2 + random.uniform(-2, 2), 1),
-            "humidity": random.randint(30, 90),
-            "precip": day_precip,
-            "windspeed": round(random.uniform(5, 20), 1),
-            "winddir": random.randint(0, 359),
-            "cloudcover": random.randint(0, 100),
-            "uvindex": max(0, random.randint(1, 10)),
-            "visibility": round(random.uniform(15, 30), 1),
-            "pressure": round(random.uniform(995, 1025), 1),
-            "conditions": day_conditions,
-            "description": f"{day_conditions} weather expected",
-            "icon": day_icon
-        })
-    
-    return {
-        "queryCost": 1,
-        "latitude": lat,
-        "longitude": lon,
-        "resolvedAddress": location_name,
-        "address": f"{lat},{lon}",
-        "timezone": "UTC",
-        "tzoffset": 0.0,
-        "currentConditions": {
-            "datetime": datetime.now().strftime("%H:%M:%S"),
-            "datetimeEpoch": int(datetime.now().timestamp()),
-            "temp": temperature,
-            "feelslike": round(temperature + random.uniform(-2, 2), 1),
-            "humidity": humidity,
-            "precip": precip,
-            "windspeed": wind_speed,
-            "winddir": wind_dir,
-            "cloudcover": cloud_cover,
-            "uvindex": uv_index,
-            "visibility": visibility,
-            "pressure": pressure,
-            "conditions": conditions,
-            "description": description,
-            "icon": icon
-        },
-        "days": forecast_days
-    }
+    """Generate realistic mock weather data in Visual Crossing format
+
+    Values are derived from the location and date, so identical requests get identical weather
+    """
+    record_mock_fallback('weather')
+    return mock_timeline(lat, lon, location_name, date)
 
 def format_visual_crossing_response(data: dict, location_name: str, lat: float, lon: float):
     """Format Visual Crossing API response to match our expected format"""
@@ -352,6 +545,25 @@ def get_weather_icon(conditions: str) -> str:
     else:
         return 'clear'
 
+# Global instance
+# Every worker runs its own hub. A refresh accepts what another worker's hub fetched earlier in the
+# same interval, so each location costs about one upstream call per interval per host rather than per
+# worker; the margin keeps a worker from mistaking its own previous refresh for a fresh one.
+HUB_CACHE_MARGIN = 0.9
+weather_hub = WeatherHub(
+    lambda lat, lon, location_name: fetch_weather_data(
+        lat, lon, location_name, priority=Priority.SUBSCRIPTION,
+        max_age=max(WEATHER_CACHE_TTL, weather_hub.refresh_interval * HUB_CACHE_MARGIN))
+)
+
+job_manager = JobManager()
+
+stats_collector.add_source('quota', quota_manager.get_stats)
+stats_collector.add_source('cache', weather_cache.get_stats)
+stats_collector.add_source('hub', weather_hub.get_stats)
+stats_collector.add_source('jobs', job_manager.get_stats)
+stats_collector.add_source('climatology', climatology.get_stats)
+
 if __name__ == "__main__":
     import uvicorn
     
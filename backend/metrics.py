@@ -0,0 +1,270 @@
+"""
+Prometheus Metrics
+Request, upstream, stage and event-loop instrumentation exposed at /metrics
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+)
+from prometheus_client.core import GaugeMetricFamily
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    'foretrip_request_duration_seconds', 'HTTP request latency by route',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'foretrip_requests_in_flight', 'HTTP requests currently being handled', multiprocess_mode='livesum'
+)
+UPSTREAM_LATENCY = Histogram(
+    'foretrip_upstream_duration_seconds', 'Upstream call latency by provider',
+    ['provider'], buckets=LATENCY_BUCKETS
+)
+UPSTREAM_RESPONSES = Counter(
+    'foretrip_upstream_responses_total', 'Upstream responses by provider and status', ['provider', 'status']
+)
+MOCK_FALLBACKS = Counter(
+    'foretrip_mock_fallbacks_total', 'Responses served from generated mock data', ['kind']
+)
+STAGE_LATENCY = Histogram(
+    'foretrip_stage_duration_seconds', 'Latency of individual request stages',
+    ['stage'], buckets=LATENCY_BUCKETS
+)
+EVENT_LOOP_LAG = Histogram(
+    'foretrip_event_loop_lag_seconds', 'Delay between a scheduled wakeup and when the event loop ran it',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+
+# Spans recorded during the current request, when a middleware has opted in (see profiling.py)
+request_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('request_spans', default=None)
+
+
+def _record_span(name: str, seconds: float):
+    spans = request_spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+class UpstreamCall:
+    """Handle yielded by `track_upstream`; call `finish(status)` once the response is read"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def finish(self, status: Any):
+        if self.finished:
+            return
+        self.finished = True
+        elapsed = time.perf_counter() - self.started
+        UPSTREAM_LATENCY.labels(self.provider).observe(elapsed)
+        _record_span(f'upstream:{self.provider}', elapsed)
+        UPSTREAM_RESPONSES.labels(self.provider, str(status)).inc()
+
+
+@contextmanager
+def track_upstream(provider: str) -> Iterator[UpstreamCall]:
+    """Time an upstream call; exits without `finish` are recorded as timeout/error"""
+    call = UpstreamCall(provider)
+    try:
+        yield call
+    except asyncio.TimeoutError:
+        call.finish('timeout')
+        raise
+    except Exception:
+        call.finish('error')
+        raise
+    finally:
+        call.finish('error')
+
+
+@contextmanager
+def timed_span(stage: str):
+    """Record how long a block of a request took"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.labels(stage).observe(elapsed)
+        _record_span(stage, elapsed)
+
+
+def record_mock_fallback(kind: str):
+    MOCK_FALLBACKS.labels(kind).inc()
+
+
+def route_template(scope: Dict[str, Any]) -> str:
+    """Route path (e.g. /weather) rather than the raw URL, to keep label cardinality bounded"""
+    # Resolved once per request; both middlewares ask
+    template = scope.get('foretrip.route')
+    if template is None:
+        template = 'unmatched'
+        for route in scope['app'].routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                template = route.path
+                break
+        scope['foretrip.route'] = template
+    return template
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and in-flight count for HTTP requests"""
+
+    def __init__(self, app, exclude_routes: tuple = ()):
+        self.app = app
+        # Open-ended streams (server-sent events) would only skew the latency histogram
+        self.exclude_routes = exclude_routes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = route_template(scope)
+            if route not in self.exclude_routes:
+                REQUEST_LATENCY.labels(scope['method'], route, str(status['code'])).observe(
+                    time.perf_counter() - started
+                )
+
+
+class StatsCollector:
+    """Exposes `get_stats()` dicts from other modules (quota, cache, hub) to Prometheus
+
+    Running counts (hits, rejections, reported cost, ...) are mirrored into
+    prometheus_client counters by `sync`, so with PROMETHEUS_MULTIPROC_DIR they
+    add up across workers like the other counters. Everything else is a gauge
+    of the worker answering the scrape, labelled with its pid in that mode.
+    """
+
+    COUNTED_KEYS = ('hits', 'misses', 'degraded', 'admitted', 'rejected')
+
+    def __init__(self, registry: CollectorRegistry = REGISTRY):
+        self.sources: List[Tuple[str, Callable[[], Dict[str, Any]]]] = []
+        self.registry = registry
+        self._counters: Dict[str, Counter] = {}
+        self._synced: Dict[Tuple[str, Optional[str]], float] = {}
+        self._sync_lock = threading.Lock()
+
+    def add_source(self, name: str, get_stats: Callable[[], Dict[str, Any]]):
+        self.sources.append((name, get_stats))
+
+    def _stats(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for name, get_stats in self.sources:
+            try:
+                yield name, get_stats()
+            except Exception as e:
+                logger.error(f"Failed to collect {name} stats: {e}")
+
+    def _walk(self, prefix: str, stats: Dict[str, Any]):
+        """(metric, help, key label or None, value, is a running count) for each number in a stats dict"""
+        for key, value in stats.items():
+            metric = f'{prefix}_{key}'
+            counted = key.endswith('_total') or key in self.COUNTED_KEYS
+            if isinstance(value, (int, float)):
+                yield metric, f'{prefix} {key}', None, int(value) if isinstance(value, bool) else value, \
+                    counted and not isinstance(value, bool)
+            elif isinstance(value, dict) and value and all(isinstance(v, (int, float)) for v in value.values()):
+                # Flat dicts of numbers become one labelled family, e.g. admitted{key="interactive"}
+                for label, number in value.items():
+                    yield metric, f'{prefix} {key}', str(label), number, counted
+            elif isinstance(value, dict):
+                yield from self._walk(metric, value)
+
+    def sync(self):
+        """Add what each running count grew by since the last sync to its counter"""
+        with self._sync_lock:
+            for name, stats in self._stats():
+                for metric, help_text, label, value, counted in self._walk(f'foretrip_{name}', stats):
+                    if not counted:
+                        continue
+                    counter = self._counters.get(metric)
+                    if counter is None:
+                        counter = self._counters[metric] = Counter(
+                            metric.removesuffix('_total'), help_text, ['key'] if label is not None else [],
+                            registry=self.registry)
+                    last = self._synced.get((metric, label), 0)
+                    # A count below its last value means the source was recreated
+                    growth = value - last if value >= last else value
+                    child = counter.labels(label) if label is not None else counter
+                    if growth:
+                        child.inc(growth)
+                    self._synced[(metric, label)] = value
+
+    def collect(self):
+        pid = [str(os.getpid())] if os.getenv('PROMETHEUS_MULTIPROC_DIR') else []
+        pid_label = ['pid'] if pid else []
+        for name, stats in self._stats():
+            families: Dict[str, GaugeMetricFamily] = {}
+            for metric, help_text, label, value, counted in self._walk(f'foretrip_{name}', stats):
+                if counted:
+                    continue
+                keys = [label] if label is not None else []
+                if metric not in families:
+                    families[metric] = GaugeMetricFamily(
+                        metric, help_text, labels=(['key'] if label is not None else []) + pid_label)
+                families[metric].add_metric(keys + pid, value)
+            yield from families.values()
+
+
+stats_collector = StatsCollector()
+REGISTRY.register(stats_collector)
+
+
+async def sync_stats_counters(interval: float = None):
+    """Keep this worker's share of the stats counters current between scrapes; run as a background task"""
+    interval = interval or float(os.getenv('METRICS_SYNC_INTERVAL', '5'))
+    while True:
+        await asyncio.sleep(interval)
+        stats_collector.sync()
+
+
+async def monitor_event_loop_lag(interval: float = None):
+    """Measure how late the loop wakes this task up; run as a background task"""
+    interval = interval or float(os.getenv('EVENT_LOOP_LAG_INTERVAL', '0.5'))
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - scheduled))
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Prometheus exposition payload, aggregated across workers when PROMETHEUS_MULTIPROC_DIR is set"""
+    registry = REGISTRY
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(stats_collector)
+    stats_collector.sync()
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,216 @@
+"""
+Mock Weather Generator
+Vectorized, deterministic Visual Crossing-style weather for offline and degraded mode
+
+Every value is derived from a hash of the location (rounded to 0.01°) and the
+date, so identical requests always return identical weather and thousands of
+location-days can be generated in one NumPy pass.
+"""
+
+from datetime import date as Date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+# Independent random streams per field; the current-conditions streams use a separate salt
+_FIELDS = ('temp', 'spread', 'feels', 'humidity', 'precip', 'wind', 'winddir',
+           'cloud', 'uv', 'visibility', 'pressure')
+_CURRENT_SALT = 0x5EED
+
+
+def _splitmix64(x: np.ndarray) -> np.ndarray:
+    """Vectorized splitmix64 finalizer over uint64 arrays"""
+    x = x + _GOLDEN
+    x = (x ^ (x >> np.uint64(30))) * _MIX_1
+    x = (x ^ (x >> np.uint64(27))) * _MIX_2
+    return x ^ (x >> np.uint64(31))
+
+
+def _as_u64(values: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(values, dtype=np.int64).view(np.uint64)
+
+
+def location_seeds(lats: Sequence[float], lons: Sequence[float]) -> np.ndarray:
+    """One seed per location, stable for coordinates that round to the same 0.01°"""
+    lat_q = _as_u64(np.round(np.asarray(lats, dtype=np.float64) * 100))
+    lon_q = _as_u64(np.round(np.asarray(lons, dtype=np.float64) * 100))
+    return _splitmix64(_splitmix64(lat_q) ^ lon_q)
+
+
+@lru_cache(maxsize=None)
+def _stream_keys(salt: int) -> np.ndarray:
+    return _splitmix64(np.arange(len(_FIELDS), dtype=np.uint64) + np.uint64(salt * 64))
+
+
+def _uniforms(seeds: np.ndarray, salt: int) -> Dict[str, np.ndarray]:
+    """Uniform [0, 1) floats per seed for every field, each field an independent stream
+
+    All streams are hashed in one broadcast pass; per-call overhead dominates for small requests.
+    """
+    bits = _splitmix64(seeds[..., None] ^ _stream_keys(salt))
+    u = (bits >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+    return {name: u[..., i] for i, name in enumerate(_FIELDS)}
+
+
+def _seasonal_offset(lats: np.ndarray, day_of_year: np.ndarray) -> np.ndarray:
+    """Warmer in each hemisphere's summer, with larger swings away from the equator"""
+    amplitude = 8.0 * np.clip(np.abs(lats) / 45.0, 0, 1) * np.sign(lats)
+    return amplitude * np.cos(2 * np.pi * (day_of_year - 196) / 365.25)
+
+
+def _fields(lats: np.ndarray, seeds: np.ndarray, day_of_year: np.ndarray, salt: int = 0) -> Dict[str, np.ndarray]:
+    u = _uniforms(seeds, salt)
+    base = 20 - np.abs(lats) / 3 + _seasonal_offset(lats, day_of_year)
+
+    tempmax = base + u['temp'] * 10 - 5
+    tempmin = tempmax - (5 + u['spread'] * 5)
+    temp = (tempmax + tempmin) / 2
+    return {
+        'tempmax': np.round(tempmax, 1),
+        'tempmin': np.round(tempmin, 1),
+        'temp': np.round(temp, 1),
+        'feelslike': np.round(temp + u['feels'] * 4 - 2, 1),
+        'humidity': (30 + u['humidity'] * 61).astype(np.int64),
+        'precip': np.round(np.where(u['precip'] < 0.6, 0.0, (u['precip'] - 0.6) / 0.4 * 5), 1),
+        'windspeed': np.round(5 + u['wind'] * 20, 1),
+        'winddir': (u['winddir'] * 360).astype(np.int64),
+        'cloudcover': (u['cloud'] * 101).astype(np.int64),
+        'uvindex': np.maximum(0, (1 + u['uv'] * 11).astype(np.int64) - (np.abs(lats) // 10).astype(np.int64)),
+        'visibility': np.round(10 + u['visibility'] * 20, 1),
+        'pressure': np.round(990 + u['pressure'] * 40, 1),
+    }
+
+
+def generate_days(lats: Sequence[float], lons: Sequence[float], start: Date, days: int) -> Dict[str, np.ndarray]:
+    """Daily weather for every location, each field shaped (locations, days)"""
+    lats = np.round(np.asarray(lats, dtype=np.float64), 2)[:, None]
+    dates = np.datetime64(start, 'D') + np.arange(days)
+    day_of_year = ((dates - dates.astype('datetime64[Y]')).astype(np.int64) + 1)[None, :]
+    ordinals = dates.astype(np.int64)
+    seeds = _splitmix64(location_seeds(lats[:, 0], lons)[:, None] ^ _as_u64(ordinals)[None, :])
+    return _fields(lats, seeds, day_of_year)
+
+
+def generate_current(lats: Sequence[float], lons: Sequence[float], when: datetime) -> Dict[str, np.ndarray]:
+    """Current conditions per location, stable within each hour"""
+    lats = np.round(np.asarray(lats, dtype=np.float64), 2)
+    hour_index = when.toordinal() * 24 + when.hour
+    seeds = _splitmix64(location_seeds(lats, lons) ^ np.uint64(hour_index))
+    day_of_year = np.full(lats.shape, when.timetuple().tm_yday)
+    return _fields(lats, seeds, day_of_year, salt=_CURRENT_SALT)
+
+
+def _day_condition(precip: float, cloudcover: int) -> Tuple[str, str]:
+    if precip > 1:
+        return "Rain", "rain"
+    if cloudcover > 50:
+        return "Partly cloudy", "partly-cloudy"
+    return "Clear", "clear"
+
+
+def _condition(precip: float, cloudcover: int) -> Tuple[str, str, str]:
+    if precip > 2:
+        return "Rain", "Rainy weather with precipitation", "rain"
+    if cloudcover > 80:
+        return "Overcast", "Overcast skies with heavy cloud cover", "cloudy"
+    if cloudcover > 50:
+        return "Partly cloudy", "Partly cloudy with some sun", "partly-cloudy"
+    return "Clear", "Clear skies with plenty of sunshine", "clear"
+
+
+_DAY_KEYS = ('tempmax', 'tempmin', 'temp', 'feelslike', 'humidity', 'precip', 'windspeed',
+             'winddir', 'cloudcover', 'uvindex', 'visibility', 'pressure')
+
+
+def _start_date(date: Optional[str], now: datetime) -> datetime:
+    """First day of the response; accepts YYYY-MM-DD or a YYYY-MM-DD/YYYY-MM-DD range"""
+    if date:
+        try:
+            return datetime.strptime(date.split('/')[0], "%Y-%m-%d").replace(hour=12)
+        except ValueError:
+            pass
+    return now
+
+
+def mock_timelines(locations: Sequence[Tuple[float, float, str]], date: Optional[str] = None,
+                   days: int = 7, now: Optional[datetime] = None) -> List[Dict]:
+    """Visual Crossing-format responses for many (lat, lon, name) locations in one pass"""
+    if not locations:
+        return []
+    now = (now or datetime.now()).replace(minute=0, second=0, microsecond=0)
+    start = _start_date(date, now)
+    lats = [loc[0] for loc in locations]
+    lons = [loc[1] for loc in locations]
+
+    daily = generate_days(lats, lons, start.date(), days)
+    current = generate_current(lats, lons, start)
+    # One bulk conversion to Python scalars instead of per-element NumPy access
+    daily_lists = {key: daily[key].tolist() for key in _DAY_KEYS}
+    current_lists = {key: current[key].tolist() for key in _DAY_KEYS}
+    dates = [(start.date() + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days)]
+
+    responses = []
+    for i, (lat, lon, location_name) in enumerate(locations):
+        forecast_days = []
+        for d in range(days):
+            day = {key: daily_lists[key][i][d] for key in _DAY_KEYS}
+            conditions, icon = _day_condition(day['precip'], day['cloudcover'])
+            forecast_days.append({
+                "datetime": dates[d],
+                **day,
+                "conditions": conditions,
+                "description": f"{conditions} weather expected",
+                "icon": icon
+            })
+
+        now_values = {key: current_lists[key][i] for key in _DAY_KEYS if key not in ('tempmax', 'tempmin')}
+        conditions, description, icon = _condition(now_values['precip'], now_values['cloudcover'])
+        responses.append({
+            "queryCost": 1,
+            "latitude": lat,
+            "longitude": lon,
+            "resolvedAddress": location_name,
+            "address": f"{lat},{lon}",
+            "timezone": "UTC",
+            "tzoffset": 0.0,
+            "currentConditions": {
+                "datetime": start.strftime("%H:%M:%S"),
+                "datetimeEpoch": int(start.timestamp()),
+                **now_values,
+                "conditions": conditions,
+                "description": description,
+                "icon": icon
+            },
+            "days": forecast_days
+        })
+    return responses
+
+
+@lru_cache(maxsize=4096)
+def _cached_timeline(lat: float, lon: float, start: datetime, days: int) -> Dict:
+    return mock_timelines([(lat, lon, '')], days=days, now=start)[0]
+
+
+def mock_timeline(lat: float, lon: float, location_name: str, date: Optional[str] = None, days: int = 7) -> Dict:
+    """Visual Crossing-format response for a single location
+
+    Output only depends on the 0.01° location, the start hour and `days`, so
+    repeated requests are served from a memo instead of a NumPy pass.
+    """
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    cached = _cached_timeline(round(lat, 2), round(lon, 2), _start_date(date, now), days)
+    # Fresh containers so callers can modify the response without touching the memo
+    return {
+        **cached,
+        "latitude": lat,
+        "longitude": lon,
+        "resolvedAddress": location_name,
+        "address": f"{lat},{lon}",
+        "currentConditions": dict(cached["currentConditions"]),
+        "days": [dict(day) for day in cached["days"]]
+    }
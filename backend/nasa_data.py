@@ -13,7 +13,9 @@ import requests
 from requests.auth import HTTPBasicAuth
 import aiohttp
 import asyncio
+import zlib
 from credentials import nasa_creds
+from metrics import track_upstream
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -41,53 +43,124 @@ class NASADataAccess:
         except Exception as e:
             logger.error(f"Failed to setup authentication: {e}")
     
-    async def get_gpm_precipitation_data(self, 
-                                       start_date: str = "2024-01-01", 
-                                       end_date: str = "2024-01-07",
-                                       lat_range: tuple = (20, 50),
-                                       lon_range: tuple = (-130, -60)) -> Dict[str, Any]:
+    @staticmethod
+    def _daily_fields(stream: str, time_range: pd.DatetimeIndex, shape: tuple, generate) -> np.ndarray:
+        """Stack one synthetic grid per day, seeded by the date so a day looks the same in every request"""
+        seed = zlib.crc32(stream.encode())
+        grids = [generate(np.random.default_rng([42, seed, day.toordinal()]), shape) for day in time_range]
+        return np.array(grids, dtype=np.float64).reshape((len(time_range),) + shape)
+    
+    def open_gpm_dataset(self,
+                         start_date: str,
+                         end_date: str,
+                         lat_range: tuple = (20, 50),
+                         lon_range: tuple = (-130, -60)) -> xr.Dataset:
         """
-        Fetch GPM (Global Precipitation Measurement) data
-        Example OPeNDAP URL for GPM IMERG data
+        Daily GPM IMERG precipitation grids for a region
         """
-        try:
-            # Example GPM IMERG dataset URL (this is a sample structure)
-            base_url = self.opendap_urls["gpm"]
-            
-            # For demonstration, we'll create synthetic GPM-like data
-            # In real implementation, you would use actual OPeNDAP URLs
-            logger.info("Generating synthetic GPM precipitation data")
-            
-            # Create synthetic precipitation data
-            time_range = pd.date_range(start=start_date, end=end_date, freq='D')
-            lat = np.linspace(lat_range[0], lat_range[1], 50)
-            lon = np.linspace(lon_range[0], lon_range[1], 100)
-            
-            # Simulate realistic precipitation patterns
-            np.random.seed(42)
-            precipitation = np.random.exponential(2.0, (len(time_range), len(lat), len(lon)))
-            precipitation = np.where(precipitation > 10, 0, precipitation)  # Some areas with no rain
+        # Example GPM IMERG dataset URL (this is a sample structure)
+        base_url = self.opendap_urls["gpm"]
+        
+        # For demonstration, we'll create synthetic GPM-like data
+        # In real implementation, you would use actual OPeNDAP URLs
+        time_range = pd.date_range(start=start_date, end=end_date, freq='D')
+        lat = np.linspace(lat_range[0], lat_range[1], 50)
+        lon = np.linspace(lon_range[0], lon_range[1], 100)
+        
+        # Simulate realistic precipitation patterns
+        precipitation = self._daily_fields('gpm', time_range, (len(lat), len(lon)),
+                                           lambda rng, shape: rng.exponential(2.0, shape))
+        precipitation = np.where(precipitation > 10, 0, precipitation)  # Some areas with no rain
+        
+        return xr.Dataset(
+            {
+                'precipitation': (['time', 'lat', 'lon'], precipitation, {
+                    'units': 'mm/hr',
+                    'long_name': 'Precipitation Rate',
+                    'source': 'GPM IMERG (simulated)'
+                })
+            },
+            coords={
+                'time': ('time', time_range, {'long_name': 'Time'}),
+                'lat': ('lat', lat, {'units': 'degrees_north', 'long_name': 'Latitude'}),
+                'lon': ('lon', lon, {'units': 'degrees_east', 'long_name': 'Longitude'})
+            },
+            attrs={
+                'title': 'GPM IMERG Precipitation Data',
+                'source': 'NASA GPM Mission',
+                'created': datetime.now().isoformat()
+            }
+        )
+    
+    def open_modis_dataset(self,
+                           product: str,
+                           start_date: str,
+                           region: Dict[str, float],
+                           days: int = 16) -> xr.Dataset:
+        """
+        Daily MODIS grids for a region, 16 days (one composite period) by default
+        """
+        time_range = pd.date_range(start=start_date, periods=days, freq='D')
+        lat = np.linspace(region['lat_min'], region['lat_max'], 100)
+        lon = np.linspace(region['lon_min'], region['lon_max'], 150)
+        shape = (len(lat), len(lon))
+        
+        if product == "MOD11A1":  # Land Surface Temperature
+            # Simulate LST data (Kelvin)
+            base_temp = 290  # ~17°C
+            lst_day = base_temp + self._daily_fields(f'{product}-day', time_range, shape,
+                                                     lambda rng, shape: rng.normal(0, 10, shape))
+            lst_night = base_temp - 10 + self._daily_fields(f'{product}-night', time_range, shape,
+                                                            lambda rng, shape: rng.normal(0, 8, shape))
             
-            # Create xarray Dataset
-            ds = xr.Dataset(
+            return xr.Dataset(
                 {
-                    'precipitation': (['time', 'lat', 'lon'], precipitation, {
-                        'units': 'mm/hr',
-                        'long_name': 'Precipitation Rate',
-                        'source': 'GPM IMERG (simulated)'
+                    'LST_Day': (['time', 'lat', 'lon'], lst_day, {
+                        'units': 'Kelvin',
+                        'long_name': 'Land Surface Temperature Day',
+                        'scale_factor': 0.02
+                    }),
+                    'LST_Night': (['time', 'lat', 'lon'], lst_night, {
+                        'units': 'Kelvin', 
+                        'long_name': 'Land Surface Temperature Night',
+                        'scale_factor': 0.02
                     })
                 },
                 coords={
-                    'time': ('time', time_range, {'long_name': 'Time'}),
-                    'lat': ('lat', lat, {'units': 'degrees_north', 'long_name': 'Latitude'}),
-                    'lon': ('lon', lon, {'units': 'degrees_east', 'long_name': 'Longitude'})
+                    'time': time_range,
+                    'lat': lat,
+                    'lon': lon
                 },
                 attrs={
-                    'title': 'GPM IMERG Precipitation Data',
-                    'source': 'NASA GPM Mission',
-                    'created': datetime.now().isoformat()
+                    'product': product,
+                    'source': 'MODIS Terra',
+                    'resolution': '1km'
                 }
             )
+        
+        # Generic MODIS data
+        data = self._daily_fields(product, time_range, shape, lambda rng, shape: rng.normal(0.5, 0.2, shape))
+        return xr.Dataset(
+            {
+                'data': (['time', 'lat', 'lon'], data, {
+                    'long_name': f'MODIS {product} Data'
+                })
+            },
+            coords={'time': time_range, 'lat': lat, 'lon': lon}
+        )
+    
+    async def get_gpm_precipitation_data(self, 
+                                       start_date: str = "2024-01-01", 
+                                       end_date: str = "2024-01-07",
+                                       lat_range: tuple = (20, 50),
+                                       lon_range: tuple = (-130, -60)) -> Dict[str, Any]:
+        """
+        Fetch GPM (Global Precipitation Measurement) data
+        Example OPeNDAP URL for GPM IMERG data
+        """
+        try:
+            logger.info("Generating synthetic GPM precipitation data")
+            ds = self.open_gpm_dataset(start_date, end_date, lat_range, lon_range)
             
             # Calculate statistics
             stats = {
@@ -107,7 +180,7 @@ class NASADataAccess:
             
             return {
                 'dataset_info': {
-                    'dimensions': dict(ds.dims),
+                    'dimensions': dict(ds.sizes),
                     'variables': list(ds.data_vars.keys()),
                     'coordinates': list(ds.coords.keys()),
                     'attributes': dict(ds.attrs)
@@ -124,62 +197,18 @@ class NASADataAccess:
     async def get_modis_data(self, 
                            product: str = "MOD11A1",
                            start_date: str = "2024-01-01",
-                           region: Dict[str, float] = None) -> Dict[str, Any]:
+                           region: Dict[str, float] = None,
+                           days: int = 16) -> Dict[str, Any]:
         """
         Fetch MODIS data (Land Surface Temperature, Vegetation, etc.)
+        Covers one 16-day composite period unless `days` is given
         """
         try:
             if region is None:
                 region = {'lat_min': 25, 'lat_max': 50, 'lon_min': -125, 'lon_max': -65}
             
             logger.info(f"Generating synthetic MODIS {product} data")
-            
-            # Create synthetic MODIS data
-            time_range = pd.date_range(start=start_date, periods=16, freq='D')  # 16-day composite
-            lat = np.linspace(region['lat_min'], region['lat_max'], 100)
-            lon = np.linspace(region['lon_min'], region['lon_max'], 150)
-            
-            if product == "MOD11A1":  # Land Surface Temperature
-                # Simulate LST data (Kelvin)
-                base_temp = 290  # ~17°C
-                lst_day = base_temp + np.random.normal(0, 10, (len(time_range), len(lat), len(lon)))
-                lst_night = base_temp - 10 + np.random.normal(0, 8, (len(time_range), len(lat), len(lon)))
-                
-                ds = xr.Dataset(
-                    {
-                        'LST_Day': (['time', 'lat', 'lon'], lst_day, {
-                            'units': 'Kelvin',
-                            'long_name': 'Land Surface Temperature Day',
-                            'scale_factor': 0.02
-                        }),
-                        'LST_Night': (['time', 'lat', 'lon'], lst_night, {
-                            'units': 'Kelvin', 
-                            'long_name': 'Land Surface Temperature Night',
-                            'scale_factor': 0.02
-                        })
-                    },
-                    coords={
-                        'time': time_range,
-                        'lat': lat,
-                        'lon': lon
-                    },
-                    attrs={
-                        'product': product,
-                        'source': 'MODIS Terra',
-                        'resolution': '1km'
-                    }
-                )
-            else:
-                # Generic MODIS data
-                data = np.random.normal(0.5, 0.2, (len(time_range), len(lat), len(lon)))
-                ds = xr.Dataset(
-                    {
-                        'data': (['time', 'lat', 'lon'], data, {
-                            'long_name': f'MODIS {product} Data'
-                        })
-                    },
-                    coords={'time': time_range, 'lat': lat, 'lon': lon}
-                )
+            ds = self.open_modis_dataset(product, start_date, region, days)
             
             # Calculate statistics
             stats = {}
@@ -193,7 +222,7 @@ class NASADataAccess:
             
             return {
                 'product': product,
-                'dataset_info': dict(ds.dims),
+                'dataset_info': dict(ds.sizes),
                 'statistics': stats,
                 'sample_data': ds.isel(time=0, lat=slice(0, 3), lon=slice(0, 3)).to_dict(),
                 'success': True
@@ -268,7 +297,9 @@ class NASADataAccess:
             else:
                 auth = None
             
-            response = requests.get(url, auth=auth, timeout=30)
+            with track_upstream('opendap') as call:
+                response = requests.get(url, auth=auth, timeout=30)
+                call.finish(response.status_code)
             
             return {
                 'url': url,
@@ -0,0 +1,212 @@
+"""
+On-Demand Profiling
+Time-boxed sampling profiles of the live worker and automatic capture of slow requests
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+from metrics import request_spans, route_template
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another is running"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    """Root-first `a;b;c` stack, the folded format read by flamegraph.pl and speedscope"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def _format_stack(frames) -> List[str]:
+    return [f"{os.path.basename(f.f_code.co_filename)}:{f.f_lineno} {f.f_code.co_name}" for f in frames]
+
+
+def _walk(frame) -> List:
+    """Frames from outermost to innermost"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return list(reversed(frames))
+
+
+def _await_chain(task: asyncio.Task) -> List:
+    """Frames of a suspended task from its coroutine down to the awaitable it is waiting on
+
+    Task.get_stack() stops at the outermost coroutine, since suspended frames
+    have no f_back; the awaits have to be followed instead.
+    """
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        frame = getattr(awaitable, 'cr_frame', None) or getattr(awaitable, 'gi_frame', None)
+        if frame is not None:
+            frames.append(frame)
+        awaitable = getattr(awaitable, 'cr_await', None) or getattr(awaitable, 'gi_yieldfrom', None)
+    return frames
+
+
+class SamplingProfiler:
+    """Samples thread stacks from a background thread; nothing is hooked into the profiled code"""
+
+    def __init__(self, max_seconds: float = None):
+        self.max_seconds = max_seconds or float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float = 0.01, thread_id: Optional[int] = None) -> Dict[str, Any]:
+        """Sample for `seconds`; returns folded stacks with their sample counts
+
+        Blocking; call from a worker thread. Samples only `thread_id` if given.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running")
+        try:
+            seconds = min(max(seconds, interval), self.max_seconds)
+            me = threading.get_ident()
+            stacks: Counter = Counter()
+            samples = 0
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me or (thread_id is not None and ident != thread_id):
+                        continue
+                    stacks[_collapse(frame)] += 1
+                samples += 1
+                time.sleep(interval)
+            return {'seconds': seconds, 'interval': interval, 'samples': samples, 'stacks': stacks}
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def folded(result: Dict[str, Any]) -> str:
+        return '\n'.join(f"{stack} {count}" for stack, count in result['stacks'].most_common()) + '\n'
+
+
+class SlowRequestMonitor:
+    """Snapshots requests running longer than a threshold
+
+    A watchdog thread checks in-flight requests a few times per threshold and,
+    for each slow one, records what the event loop thread is executing and
+    where the request's own coroutine is suspended. Finished slow requests get
+    their span breakdown attached. Fast requests only pay for a dict insert and
+    a context variable.
+    """
+
+    def __init__(self, threshold: float = None, keep: int = None):
+        self.threshold = threshold if threshold is not None else float(os.getenv('SLOW_REQUEST_THRESHOLD', '2'))
+        self.reports: deque = deque(maxlen=keep or int(os.getenv('SLOW_REQUEST_KEEP', '50')))
+        self._in_flight: Dict[int, Dict[str, Any]] = {}
+        self._ids = itertools.count()
+        self._watchdog: Optional[threading.Thread] = None
+        self._loop_thread_id: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def _ensure_watchdog(self):
+        if self._watchdog is None:
+            self._loop_thread_id = threading.get_ident()
+            self._watchdog = threading.Thread(target=self._watch, name='slow-request-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.threshold / 4)
+            now = time.perf_counter()
+            for entry in list(self._in_flight.values()):
+                if entry['captured'] is None and now - entry['started'] >= self.threshold:
+                    entry['captured'] = self._capture(entry, now)
+
+    def _capture(self, entry: Dict[str, Any], now: float) -> Dict[str, Any]:
+        loop_frame = sys._current_frames().get(self._loop_thread_id)
+        capture = {
+            'elapsed_at_capture': round(now - entry['started'], 3),
+            'loop_stack': _format_stack(_walk(loop_frame)),
+            'task_stack': []
+        }
+        try:
+            capture['task_stack'] = _format_stack(_await_chain(entry['task']))
+        except Exception:
+            pass
+        return capture
+
+    async def track(self, app, scope, receive, send):
+        """Run one request under the monitor"""
+        self._ensure_watchdog()
+        request_id = next(self._ids)
+        spans: List = []
+        token = request_spans.set(spans)
+        entry = {'started': time.perf_counter(), 'task': asyncio.current_task(), 'captured': None}
+        self._in_flight[request_id] = entry
+        try:
+            await app(scope, receive, send)
+        finally:
+            del self._in_flight[request_id]
+            request_spans.reset(token)
+            duration = time.perf_counter() - entry['started']
+            if duration >= self.threshold:
+                self._report(scope, duration, spans, entry['captured'])
+
+    def _report(self, scope, duration: float, spans: List, captured: Optional[Dict[str, Any]]):
+        report = {
+            'timestamp': time.time(),
+            'method': scope['method'],
+            'route': route_template(scope),
+            'path': scope['path'],
+            'query': scope.get('query_string', b'').decode('latin-1'),
+            'duration': round(duration, 3),
+            'spans': [{'name': name, 'seconds': round(seconds, 4)} for name, seconds in spans],
+            'unaccounted': round(duration - sum(seconds for _, seconds in spans), 4),
+            'capture': captured
+        }
+        self.reports.append(report)
+        breakdown = ', '.join(f"{span['name']}={span['seconds']}s" for span in report['spans']) or 'none'
+        logger.warning(f"Slow request {report['method']} {report['path']} took {report['duration']}s; spans: {breakdown}")
+
+    def get_reports(self) -> List[Dict[str, Any]]:
+        """Most recent slow requests first"""
+        return list(reversed(self.reports))
+
+
+class SlowRequestMiddleware:
+    """ASGI middleware feeding HTTP requests through a SlowRequestMonitor"""
+
+    def __init__(self, app, monitor: SlowRequestMonitor, exclude_prefixes: tuple = ('/admin/',),
+                 exclude_routes: tuple = ()):
+        self.app = app
+        self.monitor = monitor
+        # Admin endpoints such as /admin/profile and event streams are slow by design
+        self.exclude_prefixes = exclude_prefixes
+        self.exclude_routes = exclude_routes
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] != 'http' or not self.monitor.enabled or scope['path'].startswith(self.exclude_prefixes)
+                or (self.exclude_routes and route_template(scope) in self.exclude_routes)):
+            await self.app(scope, receive, send)
+            return
+        await self.monitor.track(self.app, scope, receive, send)
+
+
+# Global instances
+profiler = SamplingProfiler()
+slow_request_monitor = SlowRequestMonitor()
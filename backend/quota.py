@@ -0,0 +1,303 @@
+"""
+Upstream Quota Budget Management
+Admits Visual Crossing requests against a per-minute token bucket and a shared calendar-day budget fed by reported queryCost
+"""
+
+import os
+import time
+import heapq
+import sqlite3
+import asyncio
+import itertools
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from enum import IntEnum
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Lower values are admitted first"""
+    INTERACTIVE = 0
+    SUBSCRIPTION = 1
+    BATCH = 2
+
+
+class QuotaExceededError(Exception):
+    """Raised when a request cannot be admitted within the current budget"""
+
+
+class TokenBucket:
+    """Continuously refilling bucket; balance may go negative when reported costs exceed estimates"""
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def consume(self, cost: float):
+        self._refill()
+        self.tokens -= cost
+
+    def refund(self, cost: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def seconds_until(self, cost: float) -> float:
+        """Time until `cost` tokens will be available"""
+        shortfall = cost - self.available()
+        return max(0.0, shortfall / self.rate)
+
+
+class DailyBudget:
+    """Query cost spent per calendar day, kept in a SQLite file
+
+    Every worker process and restart sees the same spend, and the budget
+    resets at the provider's day boundary rather than refilling continuously.
+    Writes block on the database, so async callers run them on a thread;
+    reads come from a copy refreshed at most every `refresh` seconds and by
+    this process's own writes.
+    """
+
+    def __init__(self, capacity: float, path: str, utc_offset_hours: float = 0, refresh: float = 1.0):
+        self.capacity = capacity
+        self.offset = timedelta(hours=utc_offset_hours)
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        # (day, spent, monotonic time read)
+        self._known = ('', 0.0, float('-inf'))
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # WAL stays consistent with NORMAL; a power cut can lose the last moments of spend at worst
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS quota_spend (day TEXT PRIMARY KEY, spent REAL NOT NULL)')
+
+    def _now(self) -> datetime:
+        return datetime.now(timezone.utc) + self.offset
+
+    def today(self) -> str:
+        return self._now().date().isoformat()
+
+    def _remember(self, day: str, spent: float) -> float:
+        self._known = (day, spent, time.monotonic())
+        return spent
+
+    def spent(self) -> float:
+        day = self.today()
+        known_day, known, read_at = self._known
+        if known_day == day and time.monotonic() - read_at < self.refresh:
+            return known
+        with self._lock:
+            row = self._conn.execute('SELECT spent FROM quota_spend WHERE day = ?', (day,)).fetchone()
+        return self._remember(day, row[0] if row else 0.0)
+
+    def available(self) -> float:
+        return self.capacity - self.spent()
+
+    def try_consume(self, cost: float) -> bool:
+        """Atomically charge `cost` if it fits in today's budget"""
+        day = self.today()
+        with self._lock:
+            self._conn.execute('INSERT OR IGNORE INTO quota_spend (day, spent) VALUES (?, 0)', (day,))
+            row = self._conn.execute(
+                'UPDATE quota_spend SET spent = spent + ? WHERE day = ? AND spent + ? <= ? RETURNING spent',
+                (cost, day, cost, self.capacity)).fetchone()
+            if row is None:
+                self._remember(day, self._conn.execute(
+                    'SELECT spent FROM quota_spend WHERE day = ?', (day,)).fetchone()[0])
+                return False
+        self._remember(day, row[0])
+        return True
+
+    def consume(self, cost: float):
+        """Charge unconditionally; reported costs may push the spend past the cap"""
+        day = self.today()
+        with self._lock:
+            row = self._conn.execute(
+                'INSERT INTO quota_spend (day, spent) VALUES (?, ?) '
+                'ON CONFLICT(day) DO UPDATE SET spent = spent + excluded.spent RETURNING spent',
+                (day, cost)).fetchone()
+        self._remember(day, row[0])
+
+    def seconds_until_reset(self) -> float:
+        now = self._now()
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+        return (tomorrow - now).total_seconds()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class QuotaManager:
+    """Priority admission controller for upstream weather queries"""
+
+    def __init__(self,
+                 per_minute: float = None,
+                 per_day: float = None,
+                 subscription_reserve: float = None,
+                 batch_reserve: float = None,
+                 max_wait: float = None,
+                 state_path: str = None):
+        self.minute = TokenBucket(per_minute or float(os.getenv('QUOTA_PER_MINUTE', '60')), 60)
+        self.day = DailyBudget(per_day or float(os.getenv('QUOTA_PER_DAY', '1000')),
+                               state_path or os.getenv('QUOTA_STATE_PATH', 'data/quota.db'),
+                               float(os.getenv('QUOTA_DAY_UTC_OFFSET', '0')))
+        # Fraction of the daily budget that lower priorities may not dip into
+        self.reserves = {
+            Priority.INTERACTIVE: 0.0,
+            Priority.SUBSCRIPTION: subscription_reserve if subscription_reserve is not None else float(os.getenv('QUOTA_SUBSCRIPTION_RESERVE', '0.1')),
+            Priority.BATCH: batch_reserve if batch_reserve is not None else float(os.getenv('QUOTA_BATCH_RESERVE', '0.3')),
+        }
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv('QUOTA_MAX_WAIT', '2'))
+
+        # Running estimate of a query's cost, corrected by each reported queryCost
+        self.estimated_cost = 1.0
+        self._waiters: List = []
+        self._sequence = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._background: set = set()
+
+        self.stats = {
+            'admitted': {p.name.lower(): 0 for p in Priority},
+            'rejected': {p.name.lower(): 0 for p in Priority},
+            'degraded': 0,
+            'reported_cost_total': 0.0
+        }
+
+    def is_tight(self, priority: Priority = Priority.INTERACTIVE) -> bool:
+        """True when this priority should avoid spending budget and prefer cached data"""
+        floor = self.day.capacity * self.reserves[priority]
+        return self.day.available() - self.estimated_cost < floor
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE) -> float:
+        """Wait for admission; returns the cost charged, to be settled with `record` or `refund`"""
+        cost = self.estimated_cost
+        name = priority.name.lower()
+        if self.is_tight(priority):
+            self.stats['rejected'][name] += 1
+            raise QuotaExceededError(f"Daily quota reserved for higher priority requests ({name})")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = [priority, next(self._sequence), cost, future]
+        heapq.heappush(self._waiters, waiter)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait * (1 + priority))
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self.stats['rejected'][name] += 1
+                raise QuotaExceededError("Per-minute quota exhausted")
+            if future.exception() is not None:
+                # Turned away just as the wait ran out
+                self.stats['rejected'][name] += 1
+                raise future.exception()
+        except QuotaExceededError:
+            self.stats['rejected'][name] += 1
+            raise
+        except asyncio.CancelledError:
+            # Leave the queue, or hand back the minute token if it was granted meanwhile
+            if not future.cancel() and not future.cancelled() and future.exception() is None:
+                self.minute.refund(cost)
+            raise
+
+        # Checked and charged in one statement, since other workers spend from the same budget
+        charge = asyncio.ensure_future(asyncio.to_thread(self.day.try_consume, cost))
+        try:
+            charged = await asyncio.shield(charge)
+        except asyncio.CancelledError:
+            self.minute.refund(cost)
+            charge.add_done_callback(lambda done: self._refund_abandoned(done, cost))
+            raise
+        if not charged:
+            self.minute.refund(cost)
+            self.stats['rejected'][name] += 1
+            raise QuotaExceededError("Daily quota exhausted")
+        self.stats['admitted'][name] += 1
+        return cost
+
+    def _refund_abandoned(self, charge: asyncio.Future, cost: float):
+        """Give back a daily charge that landed after its caller was cancelled"""
+        if not charge.cancelled() and charge.exception() is None and charge.result():
+            task = asyncio.ensure_future(asyncio.to_thread(self.day.consume, -cost))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def record(self, charged: float, reported_cost: Any):
+        """Reconcile an admitted request with the queryCost Visual Crossing reported"""
+        try:
+            reported = float(reported_cost)
+        except (TypeError, ValueError):
+            return
+        self.stats['reported_cost_total'] += reported
+        correction = reported - charged
+        if correction:
+            self.minute.consume(correction)
+            await asyncio.to_thread(self.day.consume, correction)
+        self.estimated_cost = max(1.0, 0.8 * self.estimated_cost + 0.2 * reported)
+
+    async def refund(self, charged: float):
+        """Give back the cost of an admitted request whose upstream call failed without a reported cost"""
+        self.minute.refund(charged)
+        await asyncio.to_thread(self.day.consume, -charged)
+
+    def record_degraded(self):
+        """Count a request served from cache or mock data instead of upstream"""
+        self.stats['degraded'] += 1
+
+    def _dispatch(self):
+        """Admit waiters in priority order while the buckets allow"""
+        while self._waiters:
+            priority, _, cost, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.minute.available() < cost:
+                if self.day.available() < cost:
+                    heapq.heappop(self._waiters)
+                    future.set_exception(QuotaExceededError("Daily quota exhausted"))
+                    continue
+                self._schedule_wakeup(self.minute.seconds_until(cost))
+                return
+            heapq.heappop(self._waiters)
+            # The daily budget is charged by the waiter itself, off the event loop
+            self.minute.consume(cost)
+            future.set_result(None)
+
+    def _schedule_wakeup(self, delay: float):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        loop = asyncio.get_running_loop()
+        self._wakeup = loop.call_later(delay, self._dispatch)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Budget usage for the /quota endpoint"""
+        return {
+            'minute': {'capacity': self.minute.capacity, 'available': round(self.minute.available(), 2)},
+            'day': {'capacity': self.day.capacity, 'available': round(self.day.available(), 2),
+                    'resets_in': round(self.day.seconds_until_reset())},
+            'estimated_cost': round(self.estimated_cost, 2),
+            'queued': sum(1 for w in self._waiters if not w[3].done()),
+            'tight': {p.name.lower(): self.is_tight(p) for p in Priority},
+            **self.stats
+        }
+
+
+# Global instance
+quota_manager = QuotaManager()
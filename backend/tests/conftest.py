@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Backend modules use flat imports (`from quota import ...`), as when run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep state written by module-level instances out of the working tree
+_state_dir = tempfile.mkdtemp(prefix='foretrip-tests-')
+os.environ.setdefault('QUOTA_STATE_PATH', os.path.join(_state_dir, 'quota.db'))
+os.environ.setdefault('JOB_CHECKPOINT_DIR', os.path.join(_state_dir, 'jobs'))
+os.environ.setdefault('CLIMATOLOGY_DIR', os.path.join(_state_dir, 'climatology'))
+os.environ.setdefault('CACHE_URL', f"sqlite:///{os.path.join(_state_dir, 'cache.db')}")
@@ -0,0 +1,44 @@
+"""
+In-memory stand-in for a redis.asyncio client
+Implements just what RedisCacheBackend uses; clients built on one FakeRedisServer see each other's writes
+"""
+
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+class FakeRedisServer:
+    def __init__(self):
+        self.data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+
+    def client(self) -> 'FakeRedis':
+        return FakeRedis(self)
+
+
+class FakeRedis:
+    def __init__(self, server: FakeRedisServer = None):
+        self.server = server or FakeRedisServer()
+        self.closed = False
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.server.data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.time():
+            del self.server.data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: Any, ex: int = None, px: int = None):
+        for name, expiry in (('ex', ex), ('px', px)):
+            if expiry is not None and expiry <= 0:
+                raise ValueError(f"invalid expire time in 'set' command ({name}={expiry})")
+        expires = time.time() + ex if ex is not None else time.time() + px / 1000 if px is not None else None
+        self.server.data[key] = (value.encode() if isinstance(value, str) else value, expires)
+
+    async def delete(self, key: str) -> int:
+        return 1 if self.server.data.pop(key, None) is not None else 0
+
+    async def aclose(self):
+        self.closed = True
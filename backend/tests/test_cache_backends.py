@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+import pytest
+
+from cache_backends import MemoryCacheBackend, RedisCacheBackend, SQLiteCacheBackend, create_cache_backend
+from fake_redis import FakeRedisServer
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        cache = MemoryCacheBackend()
+    elif request.param == 'sqlite':
+        cache = SQLiteCacheBackend(str(tmp_path / 'cache.db'))
+    else:
+        cache = RedisCacheBackend(FakeRedisServer().client())
+    yield cache
+    run(cache.close())
+
+
+def test_get_set_delete_round_trip(backend):
+    async def scenario():
+        assert await backend.get('missing') is None
+        await backend.set('key', {'temp': 21.5, 'days': [1, 2]})
+        assert await backend.get('key') == {'temp': 21.5, 'days': [1, 2]}
+        await backend.delete('key')
+        assert await backend.get('key') is None
+
+    run(scenario())
+    assert backend.get_stats()['hits'] == 1
+    assert backend.get_stats()['misses'] == 2
+
+
+def test_ttl_expires_entries(backend):
+    async def scenario():
+        await backend.set('short', 1, ttl=0.05)
+        await backend.set('long', 2, ttl=60)
+        await backend.set('forever', 3)
+        assert await backend.get('short') == 1
+        await asyncio.sleep(0.1)
+        return [await backend.get(key) for key in ('short', 'long', 'forever')]
+
+    assert run(scenario()) == [None, 2, 3]
+
+
+def test_zero_ttl_is_already_expired(backend):
+    async def scenario():
+        await backend.set('key', 'old')
+        await backend.set('key', 'new', ttl=0)
+        await asyncio.sleep(0.01)
+        return await backend.get('key')
+
+    assert run(scenario()) is None
+
+
+def test_memory_backend_evicts_least_recently_used():
+    async def scenario():
+        cache = MemoryCacheBackend(max_entries=2)
+        await cache.set('a', 1)
+        await cache.set('b', 2)
+        await cache.get('a')
+        await cache.set('c', 3)
+        return [await cache.get(key) for key in ('a', 'b', 'c')]
+
+    assert run(scenario()) == [1, None, 3]
+
+
+def test_sqlite_purge_drops_expired_and_oldest_rows(tmp_path):
+    async def scenario():
+        cache = SQLiteCacheBackend(str(tmp_path / 'cache.db'), max_entries=3)
+        cache.PURGE_EVERY = 5
+        await cache.set('expired', 0, ttl=0.01)
+        await asyncio.sleep(0.02)
+        for i in range(4):
+            await cache.set(f"k{i}", i)
+            time.sleep(0.001)
+        rows = [key for (key,) in cache._conn.execute('SELECT key FROM cache ORDER BY key')]
+        await cache.close()
+        return rows
+
+    assert run(scenario()) == ['k1', 'k2', 'k3']
+
+
+def test_sqlite_writes_are_visible_to_other_connections(tmp_path):
+    """Each uvicorn worker opens its own connection to the shared file"""
+    path = str(tmp_path / 'shared.db')
+
+    async def scenario():
+        writer, reader = SQLiteCacheBackend(path), create_cache_backend(f"sqlite:///{path}")
+        await writer.set('weather:40.71,-74.01/current', {'temp': 18}, ttl=60)
+        seen = await reader.get('weather:40.71,-74.01/current')
+        await writer.delete('weather:40.71,-74.01/current')
+        gone = await reader.get('weather:40.71,-74.01/current')
+        journal = reader._conn.execute('PRAGMA journal_mode').fetchone()[0]
+        await writer.close()
+        await reader.close()
+        return seen, gone, journal
+
+    assert run(scenario()) == ({'temp': 18}, None, 'wal')
+
+
+def test_redis_clients_share_one_server():
+    async def scenario():
+        server = FakeRedisServer()
+        first, second = RedisCacheBackend(server.client()), RedisCacheBackend(server.client())
+        await first.set('key', [1, 2, 3], ttl=30)
+        value = await second.get('key')
+        await first.close()
+        return value, list(server.data), first.client.closed
+
+    assert run(scenario()) == ([1, 2, 3], ['foretrip:key'], True)
+
+
+def test_create_cache_backend_schemes(tmp_path):
+    assert isinstance(create_cache_backend('memory://'), MemoryCacheBackend)
+    sqlite = create_cache_backend(f"sqlite:///{tmp_path}/c.db")
+    assert isinstance(sqlite, SQLiteCacheBackend)
+    run(sqlite.close())
+    with pytest.raises(ValueError):
+        create_cache_backend('memcached://localhost')
+
+
+def test_default_backend_is_shared_between_workers(tmp_path, monkeypatch):
+    monkeypatch.delenv('CACHE_URL', raising=False)
+    monkeypatch.chdir(tmp_path)
+
+    async def scenario():
+        first, second = create_cache_backend(), create_cache_backend()
+        await first.set('key', 'value', ttl=30)
+        value = await second.get('key')
+        await first.close()
+        await second.close()
+        return first, value
+
+    backend, value = run(scenario())
+    assert isinstance(backend, SQLiteCacheBackend)
+    assert value == 'value'
+    assert (tmp_path / 'data' / 'cache.db').exists()
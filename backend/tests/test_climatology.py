@@ -0,0 +1,159 @@
+import asyncio
+import os
+import subprocess
+import sys
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from climatology import Climatology, ClimatologyError
+
+REGION = {'lat_min': 20.0, 'lat_max': 24.0, 'lon_min': -130.0, 'lon_max': -122.0}
+
+
+def make_climatology(tmp_path, **kwargs):
+    return Climatology(directory=str(tmp_path / 'climatology'), region=REGION, resolution=1.0,
+                       recent_days=31, **kwargs)
+
+
+def ingest(climatology, start, end):
+    return asyncio.run(climatology.ingest('precipitation', start, end))['statistics']
+
+
+def daily_cell_values(climatology, start, end, lat, lon):
+    """Recompute the cell's daily means straight from the source data"""
+    store = climatology.store('precipitation')
+    ds = climatology.nasa_data.open_gpm_dataset(
+        start, end, (REGION['lat_min'], REGION['lat_max']), (REGION['lon_min'], REGION['lon_max']))
+    grids = store.cell_means(ds['precipitation'].values, ds['lat'].values, ds['lon'].values)
+    row, col = store.locate(lat, lon)
+    days = [t.astype('datetime64[D]').item() for t in ds['time'].values]
+    return dict(zip(days, grids[:, row, col].astype(np.float32).astype(np.float64)))
+
+
+def test_incremental_ingest_matches_full_recompute_and_skips_repeats(tmp_path):
+    climatology = make_climatology(tmp_path)
+    assert ingest(climatology, '2021-01-01', '2022-12-31')['days_ingested'] == 730
+    overlap = ingest(climatology, '2022-12-01', '2023-01-31')
+    assert (overlap['days_ingested'], overlap['days_skipped']) == (31, 31)
+
+    values = daily_cell_values(climatology, '2021-01-01', '2023-01-31', 21.5, -125.5)
+    january = [v for day, v in values.items() if day.month == 1]
+    normals = climatology.normals('precipitation', 21.5, -125.5)['months'][0]
+    assert normals['count'] == len(january) == 93
+    assert normals['mean'] == pytest.approx(np.mean(january), rel=1e-5)
+    assert normals['std'] == pytest.approx(np.std(january, ddof=1), rel=1e-4)
+
+
+def test_single_year_has_no_baseline_to_compare_against(tmp_path):
+    climatology = make_climatology(tmp_path)
+    ingest(climatology, '2023-01-01', '2023-12-31')
+    result = climatology.anomaly('precipitation', 21.5, -125.5, '2023-12-31', days=7)
+    assert result['excluded_days'] == 7
+    assert result['day_of_year']['count'] == 0
+    assert result['day_of_year']['anomaly'] is None
+    assert result['percent_of_normal'] is None
+
+
+def test_anomaly_excludes_the_window_from_its_normals(tmp_path):
+    climatology = make_climatology(tmp_path)
+    ingest(climatology, '2020-01-01', '2023-12-31')
+    lat, lon = 22.5, -127.5
+    values = daily_cell_values(climatology, '2020-01-01', '2023-12-31', lat, lon)
+    window = [date(2023, 12, 25) + timedelta(days=i) for i in range(7)]
+
+    result = climatology.anomaly('precipitation', lat, lon, '2023-12-31', days=7)
+
+    observed = np.mean([values[day] for day in window])
+    same_days = [v for day, v in values.items()
+                 if (day.month, day.day) in {(d.month, d.day) for d in window} and day not in window]
+    december = [v for day, v in values.items() if day.month == 12 and day not in window]
+    assert result['observed'] == pytest.approx(observed, rel=1e-6)
+    assert result['day_of_year']['count'] == len(same_days) == 21
+    assert result['day_of_year']['mean'] == pytest.approx(np.mean(same_days), rel=1e-4)
+    assert result['day_of_year']['std'] == pytest.approx(np.std(same_days, ddof=1), rel=1e-3)
+    assert result['monthly']['count'] == len(december)
+    assert result['monthly']['mean'] == pytest.approx(np.mean(december), rel=1e-4)
+    assert result['day_of_year']['anomaly'] == pytest.approx(observed - np.mean(same_days), abs=1e-4)
+
+
+def test_supplied_value_is_compared_with_the_normals(tmp_path):
+    climatology = make_climatology(tmp_path)
+    ingest(climatology, '2022-01-01', '2022-03-31')
+    result = climatology.anomaly('precipitation', 21.5, -125.5, '2021-02-10', value=3.0)
+    # 2021 was never ingested, so nothing is excluded
+    assert (result['observed'], result['observed_days'], result['excluded_days']) == (3.0, None, 0)
+    assert result['monthly']['count'] == 28
+
+
+def test_queries_reject_bad_input(tmp_path):
+    climatology = make_climatology(tmp_path)
+    ingest(climatology, '2022-01-01', '2022-01-10')
+    with pytest.raises(ClimatologyError):
+        climatology.anomaly('precipitation', 40.0, -125.5, '2022-01-10')
+    with pytest.raises(ClimatologyError):
+        climatology.anomaly('snowfall', 21.5, -125.5, '2022-01-10')
+    with pytest.raises(ClimatologyError):
+        climatology.anomaly('precipitation', 21.5, -125.5, '2021-01-10')
+
+
+def test_changed_grid_settings_are_refused(tmp_path):
+    make_climatology(tmp_path).store('precipitation')
+    changed = Climatology(directory=str(tmp_path / 'climatology'), region=REGION, resolution=0.5, recent_days=31)
+    with pytest.raises(ClimatologyError):
+        changed.store('precipitation')
+
+
+CRASH_DURING_INGEST = """
+import asyncio, os, sys
+sys.path.insert(0, {backend!r})
+import climatology as module
+
+def die(self, meta):
+    os._exit(3)
+
+module.ClimatologyStore._write_meta = die
+store = module.Climatology(directory={directory!r}, region={region!r}, resolution=1.0, recent_days=31)
+asyncio.run(store.ingest('precipitation', '2022-01-01', '2022-01-31'))
+"""
+
+
+def test_ingest_killed_before_recording_its_dates_is_rolled_back(tmp_path):
+    directory = str(tmp_path / 'climatology')
+    climatology = make_climatology(tmp_path)
+    ingest(climatology, '2021-01-01', '2021-12-31')
+
+    # A worker dies after updating the tables but before meta.json records the chunk
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = CRASH_DURING_INGEST.format(backend=backend, directory=directory, region=REGION)
+    assert subprocess.run([sys.executable, '-c', script]).returncode == 3
+    assert os.path.exists(os.path.join(directory, 'precipitation', 'journal.npz'))
+
+    # The job API resumes the chunk in a fresh process
+    resumed = make_climatology(tmp_path)
+    assert ingest(resumed, '2022-01-01', '2022-01-31')['days_ingested'] == 31
+    assert not os.path.exists(os.path.join(directory, 'precipitation', 'journal.npz'))
+
+    values = daily_cell_values(resumed, '2021-01-01', '2022-01-31', 21.5, -125.5)
+    january = [v for day, v in values.items() if day.month == 1]
+    normals = resumed.normals('precipitation', 21.5, -125.5)['months'][0]
+    assert normals['count'] == len(january) == 62
+    assert normals['mean'] == pytest.approx(np.mean(january), rel=1e-5)
+    assert normals['std'] == pytest.approx(np.std(january, ddof=1), rel=1e-4)
+
+
+def test_stale_journal_of_a_finished_ingest_is_discarded(tmp_path):
+    climatology = make_climatology(tmp_path)
+    store = climatology.store('precipitation')
+    january = [date(2022, 1, 1) + timedelta(days=i) for i in range(31)]
+    store._write_journal(january)
+    journal = open(store._journal_path, 'rb').read()
+    ingest(climatology, '2022-01-01', '2022-01-31')
+
+    # As if the worker died after the meta write but before removing its journal
+    with open(store._journal_path, 'wb') as f:
+        f.write(journal)
+    reopened = make_climatology(tmp_path)
+    assert reopened.normals('precipitation', 21.5, -125.5)['months'][0]['count'] == 31
+    assert not os.path.exists(store._journal_path)
@@ -0,0 +1,227 @@
+import asyncio
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+from jobs import JobError, JobManager
+
+
+class FakeNASAData:
+    """Records chunk calls; statistics depend only on the requested dates"""
+
+    def __init__(self, fail_after: int = None):
+        self.calls = []
+        self.fail_after = fail_after
+
+    def _check(self):
+        self.calls.append(None)
+        if self.fail_after is not None and len(self.calls) > self.fail_after:
+            raise RuntimeError("upstream went away")
+
+    async def get_gpm_precipitation_data(self, start_date, end_date, lat_range, lon_range):
+        self._check()
+        days = (datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")).days + 1
+        return {'success': True, 'statistics': {
+            'mean_precipitation': 1.0, 'max_precipitation': 5.0, 'total_precipitation': float(days),
+            'spatial_coverage': {'lat_range': list(lat_range), 'lon_range': list(lon_range)},
+            'temporal_coverage': {'start': start_date, 'end': end_date, 'duration_days': days}}}
+
+    async def get_modis_data(self, product, start_date, region, days=16):
+        self._check()
+        end = datetime.strptime(start_date, "%Y-%m-%d") + timedelta(days=days - 1)
+        self.calls[-1] = (start_date, end.strftime("%Y-%m-%d"), days)
+        return {'success': True, 'statistics': {'LST_Day': {'mean': 290.0, 'std': 1.0, 'min': 280.0, 'max': 300.0}}}
+
+
+def make_manager(tmp_path, nasa_data=None, **kwargs):
+    return JobManager(nasa_data=nasa_data or FakeNASAData(), checkpoint_dir=str(tmp_path / 'jobs'),
+                      workers=1, chunk_days=7, **kwargs)
+
+
+async def wait_for(manager, job_id, timeout=5):
+    async def poll():
+        while manager.get_status(job_id)['status'] not in ('completed', 'failed'):
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+    return manager.get_status(job_id)
+
+
+GPM_JOB = {'start_date': '2024-01-01', 'end_date': '2024-01-31'}
+
+
+def test_gpm_job_runs_in_chunks_and_merges(tmp_path):
+    async def scenario():
+        manager = make_manager(tmp_path)
+        await manager.start()
+        status, deduplicated = await manager.submit('gpm_precipitation', GPM_JOB)
+        final = await wait_for(manager, status['job_id'])
+        result = await manager.get_result(status['job_id'])
+        await manager.stop()
+        return deduplicated, final, result
+
+    deduplicated, final, result = asyncio.run(scenario())
+    assert not deduplicated
+    assert (final['status'], final['chunks_done'], final['chunks_total']) == ('completed', 5, 5)
+    assert result['statistics']['temporal_coverage']['duration_days'] == 31
+    assert result['statistics']['total_precipitation'] == 31
+
+
+def test_identical_submissions_share_one_job(tmp_path):
+    async def scenario():
+        nasa = FakeNASAData()
+        manager = make_manager(tmp_path, nasa)
+        await manager.start()
+        first, _ = await manager.submit('gpm_precipitation', GPM_JOB)
+        second, deduplicated = await manager.submit('gpm_precipitation', dict(GPM_JOB))
+        await wait_for(manager, first['job_id'])
+        third, again = await manager.submit('gpm_precipitation', GPM_JOB)
+        await manager.stop()
+        return first, second, deduplicated, third, again, nasa.calls
+
+    first, second, deduplicated, third, again, calls = asyncio.run(scenario())
+    assert first['job_id'] == second['job_id'] == third['job_id']
+    assert deduplicated and again
+    assert len(calls) == 5
+
+
+def test_results_are_visible_to_other_workers(tmp_path):
+    """A second manager on the same checkpoint directory stands in for another uvicorn worker"""
+    async def scenario():
+        manager = make_manager(tmp_path)
+        await manager.start()
+        status, _ = await manager.submit('gpm_precipitation', GPM_JOB)
+        await wait_for(manager, status['job_id'])
+        other = make_manager(tmp_path)
+        seen = other.get_status(status['job_id']), await other.get_result(status['job_id'])
+        await manager.stop()
+        await other.stop()
+        return seen
+
+    status, result = asyncio.run(scenario())
+    assert status['status'] == 'completed'
+    assert result is not None and result['chunks'] == 5
+
+
+def test_modis_chunks_stop_at_end_date(tmp_path):
+    async def scenario():
+        nasa = FakeNASAData()
+        manager = make_manager(tmp_path, nasa)
+        await manager.start()
+        status, _ = await manager.submit('modis', {'start_date': '2024-01-01', 'end_date': '2024-02-20'})
+        await wait_for(manager, status['job_id'])
+        result = await manager.get_result(status['job_id'])
+        await manager.stop()
+        return nasa.calls, result
+
+    calls, result = asyncio.run(scenario())
+    assert [days for _, _, days in calls] == [16, 16, 16, 3]
+    assert calls[-1][1] == '2024-02-20'
+    assert result['temporal_coverage'] == {'start': '2024-01-01', 'end': '2024-02-20', 'duration_days': 51}
+
+
+def test_failed_job_resumes_from_its_last_checkpoint(tmp_path):
+    async def scenario():
+        failing = FakeNASAData(fail_after=2)
+        manager = make_manager(tmp_path, failing)
+        await manager.start()
+        status, _ = await manager.submit('gpm_precipitation', GPM_JOB)
+        failed = await wait_for(manager, status['job_id'])
+        await manager.stop()
+
+        healthy = FakeNASAData()
+        restarted = make_manager(tmp_path, healthy)
+        await restarted.start()
+        await restarted.submit('gpm_precipitation', GPM_JOB)
+        done = await wait_for(restarted, status['job_id'])
+        await restarted.stop()
+        return failed, done, len(healthy.calls)
+
+    failed, done, resumed_calls = asyncio.run(scenario())
+    assert (failed['status'], failed['chunks_done']) == ('failed', 2)
+    assert done['status'] == 'completed'
+    assert resumed_calls == 3
+
+
+def test_finished_jobs_are_forgotten_once_their_results_expire(tmp_path):
+    async def scenario():
+        manager = make_manager(tmp_path, result_ttl=0.2)
+        await manager.start()
+        status, _ = await manager.submit('gpm_precipitation', GPM_JOB)
+        await wait_for(manager, status['job_id'])
+        await asyncio.sleep(0.3)
+        manager._prune()
+        remembered = status['job_id'] in manager.jobs
+        await manager.stop()
+        return status['job_id'], remembered, manager.get_status(status['job_id'])
+
+    job_id, remembered, status = asyncio.run(scenario())
+    assert not remembered
+    assert status is None
+    assert not [name for name in os.listdir(tmp_path / 'jobs') if name.endswith('.json')]
+
+
+CRASH_MID_JOB = """
+import asyncio, os, sys
+from pathlib import Path
+sys.path[:0] = [{backend!r}, {tests!r}]
+from test_jobs import FakeNASAData, make_manager, GPM_JOB
+
+class Dying(FakeNASAData):
+    async def get_gpm_precipitation_data(self, *args):
+        if len(self.calls) == 2:
+            os._exit(3)
+        return await super().get_gpm_precipitation_data(*args)
+
+async def run():
+    manager = make_manager(Path({tmp_path!r}), Dying())
+    await manager.start()
+    await manager.submit('gpm_precipitation', GPM_JOB)
+    await asyncio.sleep(10)
+
+asyncio.run(run())
+"""
+
+
+def test_job_of_a_crashed_worker_is_resumed_even_if_its_pid_is_reused(tmp_path):
+    tests = os.path.dirname(os.path.abspath(__file__))
+    script = CRASH_MID_JOB.format(backend=os.path.dirname(tests), tests=tests, tmp_path=str(tmp_path))
+    assert subprocess.run([sys.executable, '-c', script]).returncode == 3
+    locks = [name for name in os.listdir(tmp_path / 'jobs') if name.endswith('.lock')]
+    assert len(locks) == 1
+    # The dead worker's PID now belongs to a live process
+    (tmp_path / 'jobs' / locks[0]).write_text(str(os.getppid()))
+
+    async def scenario():
+        nasa = FakeNASAData()
+        manager = make_manager(tmp_path, nasa)
+        await manager.start()
+        job_id = locks[0][:-len('.lock')]
+        done = await wait_for(manager, job_id)
+        await manager.stop()
+        return done, len(nasa.calls)
+
+    done, calls = asyncio.run(scenario())
+    assert done['status'] == 'completed'
+    assert calls == 3
+
+
+def test_running_job_is_not_claimed_by_another_worker(tmp_path):
+    manager = make_manager(tmp_path)
+    other = make_manager(tmp_path)
+    assert manager._claim('abc123')
+    assert manager._claim('abc123')
+    assert not other._claim('abc123')
+    manager._release('abc123')
+    assert other._claim('abc123')
+    other._release('abc123')
+
+
+def test_invalid_submissions_are_rejected(tmp_path):
+    manager = make_manager(tmp_path)
+    with pytest.raises(JobError):
+        asyncio.run(manager.submit('unknown', {}))
+    with pytest.raises(JobError):
+        asyncio.run(manager.submit('gpm_precipitation', {'start_date': '2024-02-01', 'end_date': '2024-01-01'}))
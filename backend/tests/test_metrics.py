@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client import multiprocess
+
+from metrics import StatsCollector
+
+
+def make_collector(stats):
+    registry = CollectorRegistry()
+    collector = StatsCollector(registry)
+    collector.add_source('cache', lambda: stats)
+    registry.register(collector)
+    return registry, collector
+
+
+def test_running_counts_become_counters_and_the_rest_gauges():
+    stats = {'backend': 'SQLiteCacheBackend', 'hits': 3, 'misses': 1, 'hit_ratio': 0.75,
+             'admitted': {'interactive': 2}}
+    registry, collector = make_collector(stats)
+    collector.sync()
+    stats.update(hits=5, admitted={'interactive': 4})
+    collector.sync()
+
+    assert registry.get_sample_value('foretrip_cache_hits_total') == 5
+    assert registry.get_sample_value('foretrip_cache_misses_total') == 1
+    assert registry.get_sample_value('foretrip_cache_admitted_total', {'key': 'interactive'}) == 4
+    assert registry.get_sample_value('foretrip_cache_hit_ratio') == 0.75
+    assert registry.get_sample_value('foretrip_cache_hits') is None
+
+
+WORKER = """
+import sys
+sys.path.insert(0, {backend!r})
+from prometheus_client import CollectorRegistry
+from metrics import StatsCollector
+
+collector = StatsCollector(CollectorRegistry())
+collector.add_source('quota', lambda: {{'degraded': {degraded}, 'reported_cost_total': 1.5, 'queued': 2}})
+collector.sync()
+"""
+
+
+def test_counters_add_up_across_worker_processes(tmp_path):
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': str(tmp_path)}
+    for degraded in (2, 5):
+        subprocess.run([sys.executable, '-c', WORKER.format(backend=backend, degraded=degraded)],
+                       env=env, check=True)
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=str(tmp_path))
+    assert registry.get_sample_value('foretrip_quota_degraded_total') == 7
+    assert registry.get_sample_value('foretrip_quota_reported_cost_total') == 3.0
+
+
+def test_gauges_carry_the_worker_pid_in_multiprocess_mode(monkeypatch, tmp_path):
+    monkeypatch.setenv('PROMETHEUS_MULTIPROC_DIR', str(tmp_path))
+    registry, _ = make_collector({'hit_ratio': 0.5})
+    assert registry.get_sample_value('foretrip_cache_hit_ratio', {'pid': str(os.getpid())}) == 0.5
+    assert b'foretrip_cache_hit_ratio{pid=' in generate_latest(registry)
@@ -0,0 +1,40 @@
+from datetime import datetime
+
+from mock_weather import generate_days, mock_timeline, mock_timelines
+
+
+def test_identical_requests_get_identical_weather():
+    assert mock_timeline(40.7128, -74.006, "New York", "2024-03-01") == \
+        mock_timeline(40.7128, -74.006, "New York", "2024-03-01")
+
+
+def test_requested_date_is_honoured():
+    response = mock_timeline(40.7128, -74.006, "New York", "2024-03-01/2024-03-07")
+    assert [day['datetime'] for day in response['days']][:2] == ['2024-03-01', '2024-03-02']
+
+
+def test_single_and_bulk_paths_agree():
+    single = mock_timeline(-33.8688, 151.2093, "Sydney", "2024-07-15")
+    bulk = mock_timelines([(-33.8688, 151.2093, "Sydney")], "2024-07-15")[0]
+    assert single == bulk
+
+
+def test_memoized_responses_are_not_shared():
+    first = mock_timeline(51.5074, -0.1278, "London", "2024-01-01")
+    first['days'][0]['temp'] = 999
+    first['currentConditions']['temp'] = 999
+    second = mock_timeline(51.5074, -0.1278, "London", "2024-01-01")
+    assert second['days'][0]['temp'] != 999
+    assert second['currentConditions']['temp'] != 999
+
+
+def test_response_keeps_the_callers_coordinates_and_name():
+    response = mock_timeline(48.85661, 2.35222, "Paris", "2024-01-01")
+    assert (response['latitude'], response['longitude'], response['resolvedAddress']) == (48.85661, 2.35222, "Paris")
+
+
+def test_bulk_generation_shapes_and_ranges():
+    days = generate_days([10.0, -45.0, 70.0], [0.0, 100.0, -20.0], datetime(2024, 1, 1).date(), 30)
+    assert days['tempmax'].shape == (3, 30)
+    assert (days['tempmin'] <= days['tempmax']).all()
+    assert ((days['humidity'] >= 30) & (days['humidity'] <= 90)).all()
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+from prometheus_client import REGISTRY
+
+import main
+from metrics import MetricsMiddleware, timed_span
+from profiling import ProfilerBusyError, SamplingProfiler, SlowRequestMiddleware, SlowRequestMonitor
+
+STREAM_ROUTE = '/jobs/{job_id}/events'
+
+
+async def fast(request):
+    return JSONResponse({'ok': True})
+
+
+async def slow(request):
+    with timed_span('format_response'):
+        await asyncio.sleep(0.2)
+    return JSONResponse({'ok': True})
+
+
+async def events(request):
+    async def body():
+        for _ in range(3):
+            await asyncio.sleep(0.05)
+            yield "event: progress\ndata: {}\n\n"
+    return StreamingResponse(body(), media_type='text/event-stream')
+
+
+def make_client(monitor):
+    app = Starlette(routes=[Route('/fast', fast), Route('/slow', slow), Route(STREAM_ROUTE, events)])
+    app.add_middleware(MetricsMiddleware, exclude_routes=(STREAM_ROUTE,))
+    app.add_middleware(SlowRequestMiddleware, monitor=monitor, exclude_routes=(STREAM_ROUTE,))
+    return TestClient(app)
+
+
+def request_count(route):
+    return REGISTRY.get_sample_value('foretrip_request_duration_seconds_count',
+                                     {'method': 'GET', 'route': route, 'status': '200'}) or 0
+
+
+def test_event_streams_are_left_out_of_slow_requests_and_latency():
+    monitor = SlowRequestMonitor(threshold=0.05)
+    before = request_count(STREAM_ROUTE), request_count('/fast')
+    with make_client(monitor) as client:
+        assert client.get('/jobs/abc/events').status_code == 200
+        assert client.get('/fast').status_code == 200
+    assert monitor.get_reports() == []
+    assert (request_count(STREAM_ROUTE), request_count('/fast')) == (before[0], before[1] + 1)
+
+
+def test_slow_request_is_reported_with_its_spans_and_stacks():
+    monitor = SlowRequestMonitor(threshold=0.05)
+    before = request_count('/slow')
+    with make_client(monitor) as client:
+        assert client.get('/fast').status_code == 200
+        assert client.get('/slow', params={'q': 1}).status_code == 200
+
+    reports = monitor.get_reports()
+    assert [(r['route'], r['query']) for r in reports] == [('/slow', 'q=1')]
+    report = reports[0]
+    assert report['duration'] >= 0.2
+    assert [span['name'] for span in report['spans']] == ['format_response']
+    assert report['spans'][0]['seconds'] >= 0.2
+    assert report['unaccounted'] < report['duration']
+    # Captured while the request was still suspended in the handler
+    assert 0.05 <= report['capture']['elapsed_at_capture'] < report['duration']
+    assert any(frame.endswith(' slow') for frame in report['capture']['task_stack'])
+    assert request_count('/slow') == before + 1
+
+
+def spin_for_profiler(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profile_is_returned_as_folded_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=spin_for_profiler, args=(stop,))
+    worker.start()
+    try:
+        profiler = SamplingProfiler(max_seconds=5)
+        result = profiler.profile(0.2, 0.005, thread_id=worker.ident)
+    finally:
+        stop.set()
+        worker.join()
+
+    lines = profiler.folded(result).splitlines()
+    stacks = [line.rsplit(' ', 1) for line in lines]
+    assert all(count.isdigit() for _, count in stacks)
+    assert sum(int(count) for _, count in stacks) == result['samples'] > 0
+    # Root first, innermost frame last, one `name (file:line)` label per frame
+    assert all('spin_for_profiler (test_profiling.py:' in stack for stack, _ in stacks)
+    assert stacks[0][0].split(';')[0].startswith('_bootstrap (threading.py:')
+
+
+def test_only_one_profile_runs_at_a_time():
+    profiler = SamplingProfiler()
+    started = threading.Event()
+    background = threading.Thread(target=lambda: (started.set(), profiler.profile(0.3, 0.01)))
+    background.start()
+    started.wait()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(ProfilerBusyError):
+            profiler.profile(0.1)
+    finally:
+        background.join()
+
+
+def test_admin_token_check_rejects_non_ascii_tokens(monkeypatch):
+    monkeypatch.setattr(main, 'ADMIN_TOKEN', 'secret')
+    main.require_admin('secret')
+    for token in ('wrong', 'sécret', None):
+        with pytest.raises(HTTPException) as excinfo:
+            main.require_admin(token)
+        assert excinfo.value.status_code == 403
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from quota import DailyBudget, Priority, QuotaExceededError, QuotaManager
+
+
+def make_manager(tmp_path, **kwargs):
+    kwargs.setdefault('per_minute', 1000)
+    kwargs.setdefault('per_day', 10)
+    kwargs.setdefault('max_wait', 0.1)
+    return QuotaManager(state_path=str(tmp_path / 'quota.db'), **kwargs)
+
+
+def test_daily_budget_is_a_hard_cap(tmp_path):
+    async def scenario():
+        manager = make_manager(tmp_path, subscription_reserve=0, batch_reserve=0)
+        admitted = 0
+        for _ in range(25):
+            try:
+                await manager.acquire(Priority.INTERACTIVE)
+                admitted += 1
+            except QuotaExceededError:
+                pass
+        return admitted
+
+    assert asyncio.run(scenario()) == 10
+
+
+def test_daily_spend_is_shared_across_managers_and_restarts(tmp_path):
+    async def spend(manager, times):
+        for _ in range(times):
+            await manager.acquire()
+
+    first = make_manager(tmp_path)
+    asyncio.run(spend(first, 6))
+    # A second worker (or the same worker after a restart) opens the same state file
+    second = make_manager(tmp_path)
+    assert second.day.spent() == 6
+    asyncio.run(spend(second, 4))
+    with pytest.raises(QuotaExceededError):
+        asyncio.run(spend(first, 1))
+
+
+def test_reported_cost_corrects_the_daily_spend(tmp_path):
+    async def scenario():
+        manager = make_manager(tmp_path)
+        charged = await manager.acquire()
+        await manager.record(charged, 4)
+        return manager.day.spent()
+
+    assert asyncio.run(scenario()) == 4
+
+
+def test_failed_upstream_calls_are_refunded(tmp_path):
+    async def scenario():
+        manager = make_manager(tmp_path, per_minute=5)
+        charged = await manager.acquire()
+        await manager.refund(charged)
+        return manager.day.spent(), manager.minute.available()
+
+    spent, minute = asyncio.run(scenario())
+    assert spent == 0
+    assert minute == pytest.approx(5)
+
+
+def test_cancelled_waiters_spend_nothing(tmp_path):
+    async def scenario():
+        manager = make_manager(tmp_path, per_minute=1, per_day=100, max_wait=5)
+        await manager.acquire()  # drain the minute bucket
+        waiter = asyncio.create_task(manager.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        manager.minute.tokens = 1
+        manager._dispatch()
+        await asyncio.sleep(0.05)
+        return manager.day.spent(), manager.minute.available(), manager.stats['admitted']['interactive']
+
+    spent, minute, admitted = asyncio.run(scenario())
+    assert (spent, admitted) == (1, 1)
+    assert minute == pytest.approx(1, abs=0.01)
+
+
+def test_budget_writes_run_off_the_event_loop(tmp_path, monkeypatch):
+    async def scenario():
+        manager = make_manager(tmp_path)
+        threads = []
+        try_consume = manager.day.try_consume
+
+        def recording(cost):
+            threads.append(threading.get_ident())
+            return try_consume(cost)
+
+        monkeypatch.setattr(manager.day, 'try_consume', recording)
+        await manager.acquire()
+        return threads, threading.get_ident()
+
+    threads, loop_thread = asyncio.run(scenario())
+    assert threads and loop_thread not in threads
+
+
+def test_spend_reads_are_cached_briefly(tmp_path):
+    first = DailyBudget(10, str(tmp_path / 'quota.db'), refresh=60)
+    second = DailyBudget(10, str(tmp_path / 'quota.db'), refresh=60)
+    assert second.available() == 10
+    assert first.try_consume(3)
+    # Another worker's spend shows up once the copy is refreshed; its own writes update it at once
+    assert first.available() == 7
+    assert second.available() == 10
+    second.refresh = 0
+    assert second.available() == 7
+
+
+def test_budget_resets_at_the_day_boundary(tmp_path, monkeypatch):
+    budget = DailyBudget(5, str(tmp_path / 'quota.db'))
+    assert budget.try_consume(5)
+    assert not budget.try_consume(1)
+    tomorrow = datetime.now(timezone.utc) + timedelta(days=1)
+    monkeypatch.setattr(budget, '_now', lambda: tomorrow)
+    assert budget.available() == 5
+    assert budget.try_consume(1)
+
+
+def test_interactive_requests_are_admitted_before_batch(tmp_path):
+    async def scenario():
+        manager = make_manager(tmp_path, per_minute=1, per_day=100, max_wait=0.5)
+        await manager.acquire()  # drain the minute bucket
+        order = []
+
+        async def request(priority):
+            try:
+                await manager.acquire(priority)
+                order.append(priority)
+            except QuotaExceededError:
+                pass
+
+        batch = asyncio.create_task(request(Priority.BATCH))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(request(Priority.INTERACTIVE))
+        await asyncio.sleep(0)
+        manager.minute.tokens = 1  # refill exactly one request's worth
+        manager._dispatch()
+        await asyncio.gather(batch, interactive)
+        return order
+
+    assert asyncio.run(scenario())[0] == Priority.INTERACTIVE
+
+
+def test_reserves_keep_batch_work_off_the_last_of_the_budget(tmp_path):
+    manager = make_manager(tmp_path, per_day=10, batch_reserve=0.5)
+    assert manager.day.try_consume(5)
+    assert manager.is_tight(Priority.BATCH)
+    assert not manager.is_tight(Priority.INTERACTIVE)
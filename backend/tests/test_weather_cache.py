@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import main
+from weather_hub import location_key
+
+
+def test_cache_hits_answer_with_the_requested_location(monkeypatch):
+    monkeypatch.setenv('VISUAL_CROSSING_API_KEY', 'test')
+
+    async def scenario():
+        first = main.format_visual_crossing_response(
+            {'address': '48.851,2.351', 'days': []}, 'Notre-Dame', 48.851, 2.351)
+        await main.weather_cache.set(f"weather:{location_key(48.851, 2.351)}/current",
+                                     {'data': first, 'fetched_at': time.time()}, ttl=60)
+        return await main.fetch_weather_data(48.853, 2.349, 'Saint-Michel')
+
+    data = asyncio.run(scenario())
+    assert (data['latitude'], data['longitude']) == (48.853, 2.349)
+    assert data['address'] == '48.853,2.349'
+    assert data['resolvedAddress'] == 'Saint-Michel'
+
+
+def test_hub_refreshes_reuse_another_workers_fetch_from_this_interval(monkeypatch):
+    monkeypatch.setenv('VISUAL_CROSSING_API_KEY', 'test')
+    upstream = []
+
+    async def acquire(priority=None):
+        upstream.append(priority)
+        raise main.QuotaExceededError("no upstream in tests")
+
+    monkeypatch.setattr(main.quota_manager, 'acquire', acquire)
+    monkeypatch.setattr(main.quota_manager, 'is_tight', lambda priority=None: False)
+
+    async def scenario():
+        data = main.format_visual_crossing_response({'days': []}, 'Somewhere', 10.0, 20.0)
+        # Written by another worker's hub 200s ago: older than WEATHER_CACHE_TTL, within the hub interval
+        await main.weather_cache.set(f"weather:{location_key(10.0, 20.0)}/current",
+                                     {'data': data, 'fetched_at': time.time() - 200}, ttl=600)
+        await main.weather_hub.fetcher(10.0, 20.0, 'Somewhere')
+        hub_calls = len(upstream)
+        await main.fetch_weather_data(10.0, 20.0, 'Somewhere')
+        return hub_calls, len(upstream)
+
+    assert main.weather_hub.refresh_interval * main.HUB_CACHE_MARGIN > 200 > main.WEATHER_CACHE_TTL
+    assert asyncio.run(scenario()) == (0, 1)
@@ -0,0 +1,147 @@
+import asyncio
+
+from weather_hub import WeatherHub, diff_weather
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_hub(fetch_delay: float = 0.05):
+    calls = []
+
+    async def fetcher(lat, lon, name):
+        calls.append((lat, lon))
+        await asyncio.sleep(fetch_delay)
+        return {'currentConditions': {'temp': 20.0}, 'days': []}
+
+    return WeatherHub(fetcher, refresh_interval=3600, max_locations=10, queue_size=8), calls
+
+
+def test_concurrent_subscribers_share_one_fetch():
+    async def scenario():
+        hub, calls = make_hub()
+        subscribers = [hub.connect(lambda message: None) for _ in range(50)]
+        await asyncio.gather(*(hub.subscribe(sub, 40.7128, -74.006, "New York") for sub in subscribers))
+        return hub, calls, subscribers
+
+    hub, calls, subscribers = run(scenario())
+    assert len(calls) == 1
+    for sub in subscribers:
+        messages = [sub.queue.get_nowait() for _ in range(sub.queue.qsize())]
+        assert [m['type'] for m in messages] == ['subscribed', 'snapshot']
+    assert hub.get_stats()['subscriptions'] == 50
+
+
+def test_distinct_locations_fetch_separately():
+    async def scenario():
+        hub, calls = make_hub()
+        subs = [hub.connect(lambda message: None) for _ in range(6)]
+        await asyncio.gather(*(hub.subscribe(sub, 10.0 + i % 3, 20.0) for i, sub in enumerate(subs)))
+        return calls
+
+    assert len(run(scenario())) == 3
+
+
+def test_cancelled_subscriber_does_not_cancel_shared_fetch():
+    async def scenario():
+        hub, calls = make_hub(fetch_delay=0.1)
+        first, second = hub.connect(lambda m: None), hub.connect(lambda m: None)
+        task = asyncio.create_task(hub.subscribe(first, 1.0, 2.0))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await hub.subscribe(second, 1.0, 2.0)
+        return hub, calls
+
+    hub, calls = run(scenario())
+    assert len(calls) == 1
+    assert '1.00,2.00' in hub.snapshots
+
+
+def test_diff_weather_only_reports_changed_fields():
+    old = {'currentConditions': {'temp': 20.0, 'humidity': 50}, 'days': [1]}
+    new = {'currentConditions': {'temp': 21.0, 'humidity': 50}, 'days': [1]}
+    assert diff_weather(old, new) == {'currentConditions': {'temp': 21.0}}
+
+
+class ScriptedFetcher:
+    """Returns the queued temperatures in turn; None stands for an upstream failure"""
+
+    def __init__(self, *temps):
+        self.temps = list(temps)
+
+    async def __call__(self, lat, lon, name):
+        temp = self.temps.pop(0)
+        if temp is None:
+            raise RuntimeError("upstream unavailable")
+        return {'currentConditions': {'temp': temp}, 'days': []}
+
+
+def drain(subscriber):
+    return [subscriber.queue.get_nowait() for _ in range(subscriber.queue.qsize())]
+
+
+def test_first_successful_refresh_after_a_failure_sends_a_snapshot():
+    async def scenario():
+        hub = WeatherHub(ScriptedFetcher(None, 20.0, 23.0), refresh_interval=3600)
+        subscriber = hub.connect(lambda message: None)
+        key = await hub.subscribe(subscriber, 1.0, 2.0)
+        await hub._shared_refresh(key)
+        await hub._shared_refresh(key)
+        return drain(subscriber)
+
+    messages = run(scenario())
+    assert [m['type'] for m in messages] == ['subscribed', 'snapshot', 'update']
+    assert messages[1]['data']['currentConditions'] == {'temp': 20.0}
+    assert messages[2]['changes'] == {'currentConditions': {'temp': 23.0}}
+
+
+def test_overflow_drops_the_backlog_and_resyncs_with_a_snapshot():
+    async def scenario():
+        hub = WeatherHub(ScriptedFetcher(20.0, 21.0, 22.0), refresh_interval=3600, queue_size=2)
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        subscriber = hub.connect(send)
+        key = await hub.subscribe(subscriber, 1.0, 2.0)  # fills the queue: subscribed, snapshot
+        await hub._shared_refresh(key)                     # overflows
+        queued = list(subscriber.queue._queue)
+        resync = set(subscriber.resync)
+
+        await hub._shared_refresh(key)                     # fits behind the notice
+        sender = asyncio.create_task(hub.sender(subscriber))
+        await asyncio.sleep(0.01)
+        hub.disconnect(subscriber)
+        await sender
+        return queued, resync, sent, subscriber.overflows
+
+    queued, resync, sent, overflows = run(scenario())
+    assert queued == [{'type': 'resync', 'locations': ['1.00,2.00']}]
+    assert resync == {'1.00,2.00'}
+    assert overflows == 1
+    # The client gets the resync notice, the update that still fit, then a full snapshot
+    assert [m['type'] for m in sent] == ['resync', 'update', 'snapshot']
+    assert sent[-1]['data']['currentConditions'] == {'temp': 22.0}
+
+
+def test_repeatedly_overflowing_client_is_disconnected():
+    async def scenario():
+        hub = WeatherHub(ScriptedFetcher(*range(20)), refresh_interval=3600, queue_size=1, max_overflows=3)
+        slow = hub.connect(lambda message: None)
+        other = hub.connect(lambda message: None)
+        key = await hub.subscribe(slow, 1.0, 2.0)
+        await hub.subscribe(other, 1.0, 2.0)
+        for _ in range(10):
+            if slow.closed:
+                break
+            await hub._shared_refresh(key)
+            drain(other)  # keeps up
+        return hub, slow, other, key
+
+    hub, slow, other, key = run(scenario())
+    assert slow.closed and slow.overflows == 3
+    assert slow.queue.get_nowait() is None  # wakes its sender so it exits
+    assert not slow.locations
+    assert hub.subscribers[key] == {other}
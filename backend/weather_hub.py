@@ -0,0 +1,243 @@
+"""
+Live Weather Subscription Hub
+Refreshes each subscribed location once per interval and fans out changes to WebSocket clients
+"""
+
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Fetcher signature: (lat, lon, location_name) -> weather payload
+WeatherFetcher = Callable[[float, float, str], Awaitable[Dict[str, Any]]]
+
+
+class SubscriptionLimitError(Exception):
+    """Raised when a subscription would exceed a client or hub limit"""
+
+
+def location_key(lat: float, lon: float) -> str:
+    """Bucket coordinates (~1km) so nearby clients share one upstream refresh"""
+    return f"{round(lat, 2):.2f},{round(lon, 2):.2f}"
+
+
+def diff_weather(old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Return only the fields of `new` that differ from `old`
+
+    Nested dicts (e.g. currentConditions) are diffed one level deep so a
+    temperature change does not resend every other current-condition field.
+    """
+    if old is None:
+        return dict(new)
+
+    changes = {}
+    for key, value in new.items():
+        previous = old.get(key)
+        if value == previous:
+            continue
+        if isinstance(value, dict) and isinstance(previous, dict):
+            changes[key] = {k: v for k, v in value.items() if previous.get(k) != v}
+        else:
+            changes[key] = value
+    return changes
+
+
+class Subscriber:
+    """A connected client with a bounded outgoing message queue"""
+
+    def __init__(self, send: Callable[[Dict[str, Any]], Awaitable[None]], queue_size: int):
+        self.send = send
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.locations: Set[str] = set()
+        # Locations whose queued updates were dropped and need a full snapshot
+        self.resync: Set[str] = set()
+        self.overflows = 0
+        self.closed = False
+
+
+class WeatherHub:
+    """Shares one upstream refresh per location across all subscribers"""
+
+    def __init__(self,
+                 fetcher: WeatherFetcher,
+                 refresh_interval: float = None,
+                 max_subscriptions_per_client: int = None,
+                 max_locations: int = None,
+                 queue_size: int = None,
+                 max_overflows: int = None,
+                 refresh_concurrency: int = None):
+        self.fetcher = fetcher
+        self.refresh_interval = refresh_interval or float(os.getenv('HUB_REFRESH_INTERVAL', '300'))
+        self.max_subscriptions_per_client = max_subscriptions_per_client or int(os.getenv('HUB_MAX_SUBSCRIPTIONS_PER_CLIENT', '10'))
+        self.max_locations = max_locations or int(os.getenv('HUB_MAX_LOCATIONS', '1000'))
+        self.queue_size = queue_size or int(os.getenv('HUB_CLIENT_QUEUE_SIZE', '32'))
+        self.max_overflows = max_overflows or int(os.getenv('HUB_MAX_CLIENT_OVERFLOWS', '5'))
+        self._refresh_semaphore = asyncio.Semaphore(refresh_concurrency or int(os.getenv('HUB_REFRESH_CONCURRENCY', '8')))
+
+        self.subscribers: Dict[str, Set[Subscriber]] = {}
+        self.names: Dict[str, str] = {}
+        self.snapshots: Dict[str, Dict[str, Any]] = {}
+        # At most one upstream fetch per location at a time; later callers await the same task
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Start the periodic refresh loop"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+            logger.info(f"Weather hub started (refresh every {self.refresh_interval}s)")
+
+    async def stop(self):
+        """Stop the refresh loop"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    def connect(self, send: Callable[[Dict[str, Any]], Awaitable[None]]) -> Subscriber:
+        """Register a new client"""
+        return Subscriber(send, self.queue_size)
+
+    def disconnect(self, subscriber: Subscriber):
+        """Drop a client and any locations nobody else is watching"""
+        subscriber.closed = True
+        # Wake the sender so it can exit
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+        for key in list(subscriber.locations):
+            self._remove(subscriber, key)
+
+    async def subscribe(self, subscriber: Subscriber, lat: float, lon: float,
+                        location_name: str = "Unknown Location") -> str:
+        """Subscribe a client to a location and queue its current snapshot"""
+        key = location_key(lat, lon)
+        if key in subscriber.locations:
+            return key
+        if len(subscriber.locations) >= self.max_subscriptions_per_client:
+            raise SubscriptionLimitError(
+                f"Client subscription limit reached ({self.max_subscriptions_per_client})")
+        if key not in self.subscribers and len(self.subscribers) >= self.max_locations:
+            raise SubscriptionLimitError(f"Hub location limit reached ({self.max_locations})")
+
+        self.subscribers.setdefault(key, set()).add(subscriber)
+        self.names.setdefault(key, location_name)
+        subscriber.locations.add(key)
+        self.enqueue(subscriber, {'type': 'subscribed', 'location': key})
+
+        if key in self.snapshots:
+            self.enqueue(subscriber, {'type': 'snapshot', 'location': key, 'data': self.snapshots[key]})
+        else:
+            # First watchers of this location: fetch now rather than waiting a full interval.
+            # The first successful fetch sends everyone watching a snapshot.
+            await self._shared_refresh(key)
+        return key
+
+    def unsubscribe(self, subscriber: Subscriber, key: str):
+        """Remove a client's subscription to a location"""
+        if key in subscriber.locations:
+            self._remove(subscriber, key)
+
+    def _remove(self, subscriber: Subscriber, key: str):
+        subscriber.locations.discard(key)
+        subscriber.resync.discard(key)
+        watchers = self.subscribers.get(key)
+        if watchers is None:
+            return
+        watchers.discard(subscriber)
+        if not watchers:
+            del self.subscribers[key]
+            self.names.pop(key, None)
+            self.snapshots.pop(key, None)
+
+    async def sender(self, subscriber: Subscriber):
+        """Drain a client's queue to its socket; run one per connection"""
+        while not subscriber.closed:
+            message = await subscriber.queue.get()
+            if message is None:
+                break
+            await subscriber.send(message)
+            # Replace dropped incremental updates with a full snapshot once the client catches up
+            while subscriber.resync and subscriber.queue.empty():
+                key = subscriber.resync.pop()
+                if key in self.snapshots:
+                    await subscriber.send({'type': 'snapshot', 'location': key, 'data': self.snapshots[key]})
+
+    def enqueue(self, subscriber: Subscriber, message: Dict[str, Any]):
+        """Queue a message without ever blocking the refresh loop on a slow client"""
+        if subscriber.closed:
+            return
+        try:
+            subscriber.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Diffs are only meaningful in order, so discard the backlog and resync with snapshots
+            subscriber.overflows += 1
+            while not subscriber.queue.empty():
+                subscriber.queue.get_nowait()
+            subscriber.resync.update(subscriber.locations)
+            if subscriber.overflows >= self.max_overflows:
+                logger.warning("Disconnecting slow weather subscriber after repeated overflows")
+                self.disconnect(subscriber)
+            else:
+                subscriber.queue.put_nowait({'type': 'resync', 'locations': sorted(subscriber.resync)})
+
+    async def _shared_refresh(self, key: str):
+        """Refresh a location, joining the fetch already running for it if there is one"""
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(key))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # A subscriber that disconnects mid-fetch must not cancel it for everyone else
+        await asyncio.shield(task)
+
+    async def _refresh(self, key: str):
+        """Fetch one location and push the changed fields to its subscribers"""
+        lat, lon = (float(part) for part in key.split(','))
+        async with self._refresh_semaphore:
+            try:
+                data = await self.fetcher(lat, lon, self.names.get(key, "Unknown Location"))
+            except Exception as e:
+                logger.error(f"Weather hub refresh failed for {key}: {e}")
+                return
+
+        if key not in self.subscribers:
+            # Everyone unsubscribed while we were fetching
+            return
+        previous = self.snapshots.get(key)
+        self.snapshots[key] = data
+        if previous is None:
+            # Updates are diffs against a snapshot, so the first data a client sees must be one
+            message = {'type': 'snapshot', 'location': key, 'data': data}
+            for subscriber in list(self.subscribers.get(key, ())):
+                self.enqueue(subscriber, message)
+            return
+
+        changes = diff_weather(previous, data)
+        if not changes:
+            return
+        message = {'type': 'update', 'location': key, 'changes': changes}
+        for subscriber in list(self.subscribers.get(key, ())):
+            self.enqueue(subscriber, message)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            keys = list(self.subscribers)
+            if keys:
+                await asyncio.gather(*(self._shared_refresh(key) for key in keys))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Summary of hub load"""
+        clients = {sub for watchers in self.subscribers.values() for sub in watchers}
+        return {
+            'locations': len(self.subscribers),
+            'subscribers': len(clients),
+            'subscriptions': sum(len(watchers) for watchers in self.subscribers.values()),
+            'refresh_interval': self.refresh_interval
+        }
@@ -32,10 +32,12 @@ def test_weather_api():
         print(f"Status Code: {response.status_code}")
         if response.status_code == 200:
             data = response.json()
-            print(f"Location: {data.get('location', {}).get('name', 'Unknown')}")
-            print(f"Temperature: {data.get('current', {}).get('temperature', 'N/A')}°C")
-            print(f"Condition: {data.get('current', {}).get('condition', 'N/A')}")
-            print(f"Humidity: {data.get('current', {}).get('humidity', 'N/A')}%")
+            current = data.get('currentConditions', {})
+            print(f"Location: {data.get('resolvedAddress', 'Unknown')}")
+            print(f"Temperature: {current.get('temp', 'N/A')}°C")
+            print(f"Condition: {current.get('conditions', 'N/A')}")
+            print(f"Humidity: {current.get('humidity', 'N/A')}%")
+            print(f"Forecast days: {len(data.get('days', []))}")
             print("✅ Weather data retrieved successfully!")
         else:
             print(f"Error: {response.text}")